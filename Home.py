@@ -1,6 +1,8 @@
 import streamlit as st
 from PIL import Image
 
+from tree_tracker.datasets import registry
+
 
 st.set_page_config(
     layout='wide',
@@ -23,6 +25,10 @@ col1.markdown("""
 
 st.sidebar.info("Powered by Omdena")
 
+# Datasets shared by every session of this server process
+with st.sidebar.expander("Loaded datasets"):
+    st.dataframe(registry.memory_usage(), hide_index=True)
+
 logo = Image.open('static/bondy-logo.png')
 col2.image(logo)
 
@@ -0,0 +1,169 @@
+import argparse
+import ast
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results", "startup.json")
+
+# Regressions are flagged above both the relative and the absolute threshold
+TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+_PROBE = """
+import time
+_start = time.perf_counter()
+{imports}
+print(time.perf_counter() - _start)
+"""
+
+
+# Function to list the dashboard entry points
+def list_pages() -> list[str]:
+    """
+    List the Streamlit scripts, Home first
+
+    :return: Paths relative to the repository root
+    """
+
+    pages = sorted(glob.glob(os.path.join(ROOT, "pages", "*.py")))
+    return ["Home.py"] + [os.path.relpath(page, ROOT) for page in pages]
+
+
+# Function to extract the module-level imports of a script
+def script_imports(path: str) -> str:
+    """
+    Collect the top-level import statements of a script
+
+    Imports inside functions or branches are lazy and are left out on purpose.
+
+    :param path: Script path relative to the repository root
+    :return: Import statements, one per line
+    """
+
+    with open(os.path.join(ROOT, path), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    return "\n".join(
+        ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def _slowest_imports(stderr: str, count: int) -> list[dict[str, Any]]:
+    # Parse -X importtime output: "import time: self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith(" " * 2):
+            rows.append({"module": name.strip(), "seconds": int(cumulative) / 1e6})
+
+    return sorted(rows, key=lambda row: row["seconds"], reverse=True)[:count]
+
+
+# Function to time the imports of one script in fresh interpreters
+def time_imports(imports: str, repeat: int = 3, top: int = 5) -> dict[str, Any]:
+    """
+    Time a block of imports in fresh interpreters, as a cold start would
+
+    :param imports: Import statements
+    :param repeat: Number of fresh interpreters, the fastest run is kept
+    :param top: Number of slowest top-level packages to report
+    :return: Best and median seconds, and the slowest packages of the best run
+    """
+
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE.format(imports=imports)],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        runs.append((float(proc.stdout.strip().splitlines()[-1]), proc.stderr))
+
+    best, stderr = min(runs)
+    return {
+        "seconds": best,
+        "median_seconds": statistics.median(seconds for seconds, _ in runs),
+        "slowest": _slowest_imports(stderr, top),
+    }
+
+
+# Function to compare results against a baseline
+def regressions(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float = TOLERANCE,
+    min_seconds: float = MIN_REGRESSION_SECONDS,
+) -> list[str]:
+    """
+    Find the scripts whose import time regressed against a baseline
+
+    :param results: Current results
+    :param baseline: Baseline results
+    :param tolerance: Allowed relative slowdown
+    :param min_seconds: Allowed absolute slowdown
+    :return: One message per regressed script
+    """
+
+    messages = []
+    for page, result in results["pages"].items():
+        before = baseline.get("pages", {}).get(page)
+        if before is None:
+            continue
+        slowdown = result["seconds"] - before["seconds"]
+        if slowdown > min_seconds and slowdown > tolerance * before["seconds"]:
+            messages.append(
+                f"{page}: {before['seconds']:.3f}s -> {result['seconds']:.3f}s "
+                f"(slowest: {', '.join(row['module'] for row in result['slowest'][:3])})"
+            )
+
+    return messages
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Time the cold-start imports of every page")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per page")
+    parser.add_argument("--output", default=RESULTS_PATH, help="JSON file to record results in")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown")
+    args = parser.parse_args(argv)
+
+    results: dict[str, Any] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "pages": {},
+    }
+    for page in list_pages():
+        result = results["pages"][page] = time_imports(script_imports(page), repeat=args.repeat)
+        print(f"{result['seconds']:7.3f}s  {page}", file=sys.stderr)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            messages = regressions(results, json.load(f), tolerance=args.tolerance)
+        for message in messages:
+            print(f"Regression {message}", file=sys.stderr)
+        return 1 if messages else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
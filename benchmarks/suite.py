@@ -0,0 +1,501 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Fixture sizes at scale 1.0
+SCENE_PIXELS = 2048
+SCENE_COUNT = 3
+PARCEL_COUNT = 500
+MASK_SHAPE = (3000, 4000)
+METEOR_SHAPE = (4 * 3 * 365, 40, 40)
+POINT_COUNT = 50
+PARCEL_FILE_COUNT = 20000
+
+
+class Recorder:
+    """
+    Collects wall time, peak memory and throughput of benchmark stages
+
+    The suite runs twice: a timing pass without tracemalloc, whose tracing slows
+    allocation-heavy stages severalfold, then a memory pass under tracemalloc whose
+    timings are discarded. Peak memory covers Python and NumPy allocations but not
+    buffers allocated inside GDAL or OpenCV.
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, dict[str, Any]] = {}
+        self.trace_memory = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items: float, unit: str) -> Iterator[None]:
+        """
+        Measure the enclosed block as one stage, its time or its peak memory by pass
+
+        :param name: Stage name
+        :param items: Work done by the stage, for the throughput
+        :param unit: Unit of the work, e.g. "Mpixel" or "image"
+        """
+
+        if self.trace_memory:
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            self.stages.setdefault(name, {})["peak_mb"] = peak / 2**20
+            print(f"{name:32s} {peak / 2**20:9.1f} MB", file=sys.stderr)
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+        self.stages[name] = {
+            "seconds": seconds,
+            "peak_mb": None,
+            "throughput": items / seconds if seconds > 0 else float("inf"),
+            "unit": f"{unit}/s",
+        }
+        print(
+            f"{name:32s} {seconds:8.3f}s {self.stages[name]['throughput']:12.1f} {unit}/s",
+            file=sys.stderr,
+        )
+
+
+# Function to generate Planet-like scenes
+def make_scenes(workdir: str, pixels: int, count: int) -> list[str]:
+    """
+    Write 4-band uint16 scenes laid out as data/planet/<region>/<name>_<date>_clip.tif
+
+    :param workdir: Fixture directory
+    :param pixels: Scene width and height
+    :param count: Number of monthly scenes
+    :return: Scene paths
+    """
+
+    import rasterio  # type: ignore
+    from rasterio.transform import from_origin  # type: ignore
+
+    from tree_tracker.cog import COG_OPTIONS
+
+    rng = np.random.default_rng(0)
+    region_dir = os.path.join(workdir, "planet", "Bench")
+    os.makedirs(region_dir, exist_ok=True)
+
+    paths = []
+    for month in range(1, count + 1):
+        path = os.path.join(region_dir, f"bench_analytic_2022-{month:02d}_clip.tif")
+        data = rng.integers(1, 4000, size=(4, pixels, pixels), dtype=np.uint16)
+        profile = {
+            "driver": "GTiff",
+            "width": pixels,
+            "height": pixels,
+            "count": 4,
+            "dtype": "uint16",
+            "crs": "EPSG:32738",
+            "transform": from_origin(500000, 8000000, 3.0, 3.0),
+        }
+        tmp_path = f"{path}.tmp.tif"
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            dst.write(data)
+        rasterio.shutil.copy(tmp_path, path, **COG_OPTIONS)
+        os.remove(tmp_path)
+        paths.append(path)
+
+    return paths
+
+
+# Function to generate parcels over the scenes
+def make_parcels(count: int, pixels: int, crs: str = "EPSG:32738") -> Any:
+    """
+    Generate random rectangular parcels inside the scene footprint
+
+    :param count: Number of parcels
+    :param pixels: Scene width and height
+    :param crs: Scene CRS
+    :return: GeoDataFrame of parcels in EPSG:4326 with the dashboard's attributes
+    """
+
+    import geopandas as gpd  # type: ignore
+    from shapely.geometry import box  # type: ignore
+
+    rng = np.random.default_rng(1)
+    extent = pixels * 3.0
+    x = 500000 + rng.uniform(0, extent * 0.95, count)
+    y = 8000000 - rng.uniform(0, extent * 0.95, count)
+    size = rng.uniform(20, 120, count)
+    folders = np.array(["Bench; Village A; Plot", "Bench; Village B", "Bench"])[
+        rng.integers(0, 3, count)
+    ]
+
+    parcels = gpd.GeoDataFrame(
+        {
+            "name": np.where(rng.random(count) < 0.4, "", [f"P{i}" for i in range(count)]),
+            "folders": folders,
+            "plotName": np.where(rng.random(count) < 0.1, "plot", None),
+            "regionName": "Bench",
+        },
+        geometry=[box(x0, y0 - s, x0 + s, y0) for x0, y0, s in zip(x, y, size)],
+        crs=crs,
+    )
+    return parcels.to_crs(4326)
+
+
+# Function to generate a blobby prediction mask
+def make_mask(shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generate an RGB image and a mask with tree-crown sized blobs
+
+    :param shape: (rows, cols)
+    :return: (image, mask)
+    """
+
+    import cv2
+
+    rng = np.random.default_rng(2)
+    noise = rng.random(shape, dtype=np.float32)
+    blurred = cv2.GaussianBlur(noise, (0, 0), 6)
+    mask = (blurred > np.quantile(blurred, 0.9)).astype(np.uint8)
+    image = rng.integers(0, 256, size=(*shape, 3), dtype=np.uint8)
+
+    return image, mask
+
+
+# Function to generate a tiny segmentation model
+def make_model(path: str) -> str | None:
+    """
+    Write a 3x3 convolution + sigmoid ONNX model with a dynamic batch
+
+    :param path: Model path
+    :return: Model path, or None when the onnx package is not installed
+    """
+
+    try:
+        import onnx  # type: ignore
+        from onnx import TensorProto, helper, numpy_helper  # type: ignore
+    except ImportError:
+        return None
+
+    from tree_tracker.inference import IMAGE_SIZE
+
+    weights = np.full((1, 3, 3, 3), 1 / 27, dtype=np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("Conv", ["x", "w"], ["c"], pads=[1, 1, 1, 1]),
+            helper.make_node("Sigmoid", ["c"], ["y"]),
+        ],
+        "bench",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, ["N", 3, IMAGE_SIZE, IMAGE_SIZE])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, ["N", 1, IMAGE_SIZE, IMAGE_SIZE])],
+        [numpy_helper.from_array(weights, "w")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+    return path
+
+
+# Function to generate a meteorological store
+def make_meteor_store(path: str, shape: tuple[int, int, int]) -> Any:
+    """
+    Write a synthetic 6-hourly ERA5-Land-like Zarr store
+
+    :param path: Zarr store path
+    :param shape: (time steps, latitudes, longitudes)
+    :return: Dataset opened from the store
+    """
+
+    import pandas as pd
+    import xarray as xr
+
+    from tree_tracker.meteor import _encoding, open_store
+
+    rng = np.random.default_rng(3)
+    steps, lats, lons = shape
+    ds = xr.Dataset(
+        {
+            name: (("valid_time", "latitude", "longitude"), values.astype(np.float32))
+            for name, values in {
+                "t2m": 290 + 8 * rng.standard_normal(shape),
+                "tp": rng.exponential(1e-4, shape),
+                "e": -rng.exponential(1e-5, shape),
+            }.items()
+        },
+        coords={
+            "valid_time": pd.date_range("2020-01-01", periods=steps, freq="6h"),
+            "latitude": np.round(-18.0 - 0.1 * np.arange(lats), 1),
+            "longitude": np.round(47.0 + 0.1 * np.arange(lons), 1),
+        },
+    )
+    ds.to_zarr(path, mode="w", encoding=_encoding(ds))
+
+    return open_store(path)
+
+
+# Function to generate a parcels GeoJSON
+def make_parcel_file(path: str, count: int) -> str:
+    """
+    Write a parcels GeoJSON with the dashboard's attributes
+
+    :param path: GeoJSON path
+    :param count: Number of parcels
+    :return: GeoJSON path
+    """
+
+    make_parcels(count, SCENE_PIXELS).to_file(path, driver="GeoJSON")
+    return path
+
+
+def bench_indices(recorder: Recorder, workdir: str, scale: float) -> None:
+    import rasterio  # type: ignore
+
+    from tree_tracker.index_catalog import update_catalog
+    from tree_tracker.indices import INDICES, compute_indices, read_indices
+
+    pixels = max(256, int(SCENE_PIXELS * scale))
+    paths = make_scenes(workdir, pixels, SCENE_COUNT)
+    mpixels = pixels * pixels / 1e6
+
+    rng = np.random.default_rng(4)
+    bands = {band: rng.random((pixels, pixels), dtype=np.float32) for band in (2, 3, 4)}
+    with recorder.stage("indices.compute", mpixels, "Mpixel"):
+        compute_indices(bands, INDICES)
+
+    with recorder.stage("indices.read_stats", mpixels * len(paths), "Mpixel"):
+        for path in paths:
+            with rasterio.open(path) as src:
+                read_indices(src, INDICES, keep_arrays=False)
+
+    catalog_path = os.path.join(workdir, "index_stats.parquet")
+    with recorder.stage("load_data.catalog_build", len(paths), "scene"):
+        update_catalog(paths, catalog_path, workers=1, rebuild=True)
+    with recorder.stage("load_data.catalog_reuse", len(paths), "scene"):
+        update_catalog(paths, catalog_path, workers=1)
+
+
+def bench_parcel_stats(recorder: Recorder, workdir: str, scale: float) -> None:
+    from tree_tracker.zonal import parcel_time_series
+
+    pixels = max(256, int(SCENE_PIXELS * scale))
+    paths = make_scenes(workdir, pixels, SCENE_COUNT)
+    parcels = make_parcels(max(10, int(PARCEL_COUNT * scale)), pixels)
+
+    with recorder.stage("parcel_stats.time_series", len(parcels) * len(paths), "parcel-scene"):
+        parcel_time_series(paths, parcels)
+
+
+def bench_masks(recorder: Recorder, workdir: str, scale: float) -> None:
+    from tree_tracker.prediction import connected_components, extract_bboxes, overlay_mask
+
+    shape = (max(64, int(MASK_SHAPE[0] * scale)), max(64, int(MASK_SHAPE[1] * scale)))
+    image, mask = make_mask(shape)
+    mpixels = shape[0] * shape[1] / 1e6
+
+    with recorder.stage("masks.connected_components", mpixels, "Mpixel"):
+        components = connected_components(mask)
+    with recorder.stage("masks.extract_bboxes", mpixels, "Mpixel"):
+        extract_bboxes(image, mask, components=components)
+    with recorder.stage("masks.extract_circles", mpixels, "Mpixel"):
+        extract_bboxes(image, mask, circle=True, components=components)
+    with recorder.stage("masks.overlay_mask", mpixels, "Mpixel"):
+        overlay_mask(image, mask, color=(0, 255, 0), alpha=0.2, components=components)
+
+
+def bench_inference(recorder: Recorder, workdir: str, scale: float) -> None:
+    from tree_tracker.inference import IMAGE_SIZE, get_session, predict_tiled, preprocess_tile
+
+    model_path = make_model(os.path.join(workdir, "bench.onnx"))
+    if model_path is None:
+        print("inference: skipped, the onnx package is not installed", file=sys.stderr)
+        return
+
+    shape = (
+        max(IMAGE_SIZE, int(MASK_SHAPE[0] * scale)),
+        max(IMAGE_SIZE, int(MASK_SHAPE[1] * scale)),
+    )
+    image, _ = make_mask(shape)
+
+    tiles = [image[:IMAGE_SIZE, :IMAGE_SIZE]] * 64
+    with recorder.stage("inference.preprocess", len(tiles), "tile"):
+        for tile in tiles:
+            preprocess_tile(tile)
+
+    with recorder.stage("inference.session", 1, "session"):
+        session = get_session(model_path)
+    with recorder.stage("inference.predict_tiled", shape[0] * shape[1] / 1e6, "Mpixel"):
+        predict_tiled(session, image)
+
+
+def bench_meteor(recorder: Recorder, workdir: str, scale: float) -> None:
+    from tree_tracker.meteor import build_daily, daily_series, point_series
+
+    steps, lats, lons = METEOR_SHAPE
+    shape = (steps, max(8, int(lats * scale)), max(8, int(lons * scale)))
+    store = os.path.join(workdir, "meteor.zarr")
+    daily = os.path.join(workdir, "meteor_daily.parquet")
+
+    with recorder.stage("meteor.write_store", shape[0] * shape[1] * shape[2] / 1e6, "Mvalue"):
+        ds = make_meteor_store(store, shape)
+
+    rng = np.random.default_rng(5)
+    points = list(
+        zip(
+            rng.uniform(ds["latitude"].min(), ds["latitude"].max(), POINT_COUNT),
+            rng.uniform(ds["longitude"].min(), ds["longitude"].max(), POINT_COUNT),
+        )
+    )
+    with recorder.stage("meteor.point_series", len(points), "point"):
+        for lat, lon in points:
+            point_series(ds, lat, lon)
+
+    with recorder.stage("meteor.build_daily", shape[1] * shape[2], "cell"):
+        build_daily(store, daily)
+    with recorder.stage("meteor.daily_series", len(points), "point"):
+        for lat, lon in points:
+            daily_series(ds, lat, lon, path=daily, store=store)
+
+
+def bench_parcels(recorder: Recorder, workdir: str, scale: float) -> None:
+    from tree_tracker.parcels import load_parcels, parcel_labels
+
+    count = max(100, int(PARCEL_FILE_COUNT * scale))
+    path = make_parcel_file(os.path.join(workdir, "parcels.geojson"), count)
+    parquet_path = os.path.join(workdir, "parcels.parquet")
+
+    with recorder.stage("parcels.convert_and_load", count, "parcel"):
+        store = load_parcels(path, parquet_path)
+    with recorder.stage("parcels.load", count, "parcel"):
+        store = load_parcels(path, parquet_path)
+    with recorder.stage("parcels.labels", count, "parcel"):
+        parcel_labels(store.parcels)
+    with recorder.stage("parcels.query", 100, "query"):
+        for geometry in store.parcels.geometry.iloc[:100]:
+            store.query(geometry)
+
+
+STAGES: dict[str, Callable[[Recorder, str, float], None]] = {
+    "indices": bench_indices,
+    "parcel_stats": bench_parcel_stats,
+    "masks": bench_masks,
+    "inference": bench_inference,
+    "meteor": bench_meteor,
+    "parcels": bench_parcels,
+}
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to compare two result files
+def compare(results: dict[str, Any], previous: dict[str, Any]) -> list[str]:
+    """
+    Format the change of every stage against a previous run
+
+    :param results: Current results
+    :param previous: Previous results
+    :return: One line per stage present in both runs
+    """
+
+    lines = []
+    for name, stage in results["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if before is None:
+            continue
+        line = (
+            f"{name:32s} {before['seconds']:8.3f}s -> {stage['seconds']:8.3f}s "
+            f"({stage['seconds'] / before['seconds'] - 1:+7.1%})"
+        )
+        if before.get("peak_mb") is not None and stage.get("peak_mb") is not None:
+            line += f", peak {before['peak_mb']:.1f} -> {stage['peak_mb']:.1f} MB"
+        lines.append(line)
+
+    return lines
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic data")
+    parser.add_argument(
+        "stages", nargs="*", help=f"Stages among {list(STAGES)}, defaults to all of them"
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="Fixture size factor")
+    parser.add_argument("--output", help="JSON results file, defaults to a timestamped file")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="Skip the tracemalloc pass measuring peak memory",
+    )
+    args = parser.parse_args(argv)
+
+    unknown = sorted(set(args.stages) - set(STAGES))
+    if unknown:
+        print(f"Unknown stages {unknown}, expected {list(STAGES)}", file=sys.stderr)
+        return 2
+
+    recorder = Recorder()
+    for trace_memory in (False, True) if args.memory else (False,):
+        # Every pass starts from fresh fixtures, so cold stages stay cold
+        recorder.trace_memory = trace_memory
+        print("Memory pass" if trace_memory else "Timing pass", file=sys.stderr)
+        for name in args.stages or STAGES:
+            with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+                STAGES[name](recorder, workdir, args.scale)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "stages": recorder.stages,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"suite-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results -> {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(results, json.load(f)):
+                print(line, file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
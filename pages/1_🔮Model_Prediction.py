@@ -1,19 +1,35 @@
+import json
 import os
+import uuid
+from urllib.parse import quote
 
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-import onnxruntime  # type: ignore
 import streamlit as st
-from skimage.measure import label, regionprops  # type: ignore
 
-from tree_tracker.util import download_data
+from tree_tracker import tracing
+from tree_tracker.cache import cached_prediction, prediction_key
+from tree_tracker.figures import PREVIEW_PIXELS, cached_figure, downsample, figure_key
+from tree_tracker.inference import get_session, predict_tiled
+from tree_tracker.prediction import (
+    connected_components,
+    extract_bboxes,
+    image_shape,
+    mask_metrics,
+    overlay_mask,
+    read_image,
+    reduction_factor,
+    scale_components,
+)
+from tree_tracker.quantize import REPORT_SUFFIX, variant_labels
+from tree_tracker.tiles import leaflet_html, pixel_max_zoom, serve_tiles
+from tree_tracker.util import fetch_object, file_digest, list_data, pin
 
 st.set_page_config(
     layout="wide",
     page_title="Tree Tracker | Model Prediction",
     page_icon="static/bondy-logo.png",
 )
+tracing.start_trace("Model Prediction", profile=tracing.profile_requested())
 st.markdown(
     """
 <style>
@@ -41,90 +57,62 @@ div[data-testid="metric-container"] > label[data-testid="stMetricLabel"] > div {
     unsafe_allow_html=True,
 )
 
+# Part of the cached figure's key, bumped whenever the prediction figure is drawn
+# differently so PNGs rendered by older code are not served
+PREDICTION_FIGURE_VERSION = 2
 
-def extract_bboxes(image, mask, circle=False):
-    bboxes = []
-    props = regionprops(label(mask))
-    for prop in props:
-        x1 = prop.bbox[1]
-        y1 = prop.bbox[0]
-        x2 = prop.bbox[3]
-        y2 = prop.bbox[2]
-
-        bboxes.append([x1, y1, x2, y2])
-
-    drawed_image = image.copy()
-
-    for bbox in bboxes:
-        x1, y1, x2, y2 = bbox
-        center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
-        radius = (x2 - x1) // 2 if (x2 - x1) > (y2 - y1) else (y2 - y1) // 2
-
-        if not circle:
-            drawed_image = cv2.rectangle(
-                drawed_image, (x1, y1), (x2, y2), color=(255, 0, 0), thickness=10
-            )
-        else:
-            drawed_image = cv2.circle(
-                drawed_image,
-                (center_x, center_y),
-                color=(255, 0, 0),
-                radius=radius,
-                thickness=10,
-            )
-
-    return bboxes, drawed_image
 
+@st.cache_data(show_spinner="Running model...", max_entries=8)
+def predict_probability(model_path, model_digest, image_digest, image_path):
+    # Only the model and image identify the probability map, the sliders act on it afterwards.
+    # The on-disk cache shares it with other processes and the batch CLI, the image is only
+    # decoded at full resolution when the model has to run
+    key = prediction_key(model_digest, image_digest)
+    return cached_prediction(
+        key, lambda: predict_tiled(get_session(model_path), read_image(image_path))
+    )
 
-def overlay_mask(image, mask, color=(255, 0, 0), alpha=0.4):
-    seg = label(mask)
-    contours, _ = cv2.findContours(seg, cv2.RETR_FLOODFILL, cv2.CHAIN_APPROX_NONE)
 
-    drawed_image = image.copy()
-    canvas = np.ones_like(image, np.uint8)
+@st.cache_data(show_spinner=False, ttl=60)
+def list_available(data_type):
+    return list_data(data_type)
 
-    for i, c in enumerate(contours):
-        cv2.drawContours(canvas, [c], -1, color, thickness=cv2.FILLED)
-        cv2.drawContours(drawed_image, [c], -1, color, thickness=10)
 
-    drawed_image = cv2.addWeighted(canvas, alpha, drawed_image, 1 - alpha, 0)
-
-    return len(np.unique(seg)) - 1, drawed_image
+@st.cache_data(show_spinner=False, ttl=60)
+def list_models():
+    # Model files, quantised variants labelled with the speedups measured by
+    # `tree_tracker quantize`
+    names = list_data("model")
+    labels = {}
+    for name in names:
+        if name.endswith(REPORT_SUFFIX):
+            with open(fetch_object(f"model/{name}")) as f:
+                report = json.load(f)
+            # Variants sit next to their report
+            folder = os.path.dirname(name)
+            for file, label in variant_labels([report]).items():
+                labels[f"{folder}/{file}" if folder else file] = label
+    return {name: labels.get(name, name) for name in names if not name.endswith(REPORT_SUFFIX)}
 
 
 st.header("🔮 Model Prediction")
 
 model_col, btn_col, file_col = st.columns([3, 1, 3])
 
-# Download data
-download_data("model")
-download_data("drone")
-
-# Model and image path
-model_path = "data/model"
-image_path = "data/drone"
+# Model and image selection widgets, listed from the bucket
+models = list_models()
+selected_model = model_col.selectbox("Choose model file", list(models), format_func=models.get)
+image_name = file_col.selectbox("Available images", list_available("drone"))
 
-# Model and image selection widgets
-selected_model = model_col.selectbox(
-    "Choose model file",
-    [image for image in os.listdir(model_path)],
-)
-selected_image = file_col.selectbox(
-    "Available images",
-    [model for model in os.listdir(image_path)],
-)
-
-# Selected model and image
-selected_model = os.path.join(model_path, selected_model)
-selected_image = os.path.join(image_path, selected_image)
-
-original_image = cv2.imread(selected_image)
-original_image = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
+# Only the selected files are fetched into the size-bounded local data cache,
+# the model and image of every session are kept in it
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+pin(f"model/{selected_model}", owner=session_id)
+pin(f"drone/{image_name}", group="image", owner=session_id)
+selected_model = fetch_object(f"model/{selected_model}")
+selected_image = fetch_object(f"drone/{image_name}")
 
 # original_mask = cv2.imread(mask_image, cv2.IMREAD_GRAYSCALE)
-IMAGE_SIZE = 416
-image = cv2.resize(original_image, (IMAGE_SIZE, IMAGE_SIZE), interpolation=cv2.INTER_AREA)
-image = np.transpose(image, (2, 0, 1)).astype(np.float32) / 255.0
 
 # Tuning Parameters
 GSD = st.sidebar.number_input(
@@ -153,24 +141,40 @@ confidence = st.sidebar.number_input(
     step=0.01,
     help="Confidence threshold is used to tune the predictions",
 )
-ort_session = onnxruntime.InferenceSession(selected_model)
-ort_inputs = {ort_session.get_inputs()[0].name: image[np.newaxis, ...]}
-ort_outs = ort_session.run(None, ort_inputs)
-pred_mask = (ort_outs[0] > confidence) * 1.0
+# Tiled inference at the native image resolution
+model_digest, image_digest = file_digest(selected_model), file_digest(selected_image)
+pred_prob = predict_probability(selected_model, model_digest, image_digest, selected_image)
+pred_mask = (pred_prob > confidence).astype(np.uint8)
 
-pred_mask = cv2.resize(pred_mask[0][0], (4000, 3000), interpolation=cv2.INTER_NEAREST)
+# Objects are labelled once, both mask types draw from the same components
+components = connected_components(pred_mask)
+patches = components.count
 
 pred_mask_type = st.sidebar.radio("Prediction Mask type", ["Bounding Boxes", "Patches"])
-if pred_mask_type == "Bounding Boxes":
-    bboxes, drawed_image = extract_bboxes(original_image, pred_mask, circle=True)
-    patches = len(bboxes)
-else:
-    patches, drawed_image = overlay_mask(original_image, pred_mask, color=(0, 255, 0), alpha=0.2)
 
-veg_percent = np.count_nonzero(pred_mask > 0.0) / np.prod(pred_mask.shape)
+veg_percent, num_tree = mask_metrics(pred_mask, GSD, tree_size_in_meters)
+
+
+def draw_prediction(image, image_components, thickness=10):
+    if pred_mask_type == "Bounding Boxes":
+        _, drawed_image = extract_bboxes(
+            image,
+            image_components.labels,
+            circle=True,
+            components=image_components,
+            thickness=thickness,
+        )
+    else:
+        _, drawed_image = overlay_mask(
+            image,
+            image_components.labels,
+            color=(0, 255, 0),
+            alpha=0.2,
+            components=image_components,
+            thickness=thickness,
+        )
+    return drawed_image
 
-tree_size_in_pixels = tree_size_in_meters / GSD
-num_tree = np.count_nonzero(pred_mask > 0.0) // tree_size_in_pixels
 
 if st.sidebar.button("Predict"):
     col_0, col_1, col_2 = st.columns(3)
@@ -180,17 +184,68 @@ if st.sidebar.button("Predict"):
 
     show_image = st.sidebar.checkbox("Show image", value=True)
     if show_image:
-        with st.spinner("Rendering images..."):
+
+        def render_prediction():
+            # The preview is decoded at a reduced resolution that still covers the 10 inch
+            # axes, the objects and their outlines are scaled to it
+            factor = reduction_factor(image_shape(selected_image), PREVIEW_PIXELS)
+            preview = read_image(selected_image, reduce=factor)
+            preview_components = scale_components(components, preview.shape[:2])
+            drawed_image = draw_prediction(
+                preview, preview_components, thickness=max(1, round(10 / factor))
+            )
+
+            # Only needed on a cache miss, kept off the page's cold start
+            import matplotlib.pyplot as plt
+
             fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
 
+            # Both panels are drawn from previews sized to the 10 inch axes
             ax1.set_title("IMAGE - GROUND TRUTH")
-            ax1.imshow(original_image)
+            ax1.imshow(downsample(preview))
             ax1.grid(False)
             ax1.set_axis_off()
 
             ax2.set_title("IMAGE - PREDICTION")
-            ax2.imshow(drawed_image)
+            ax2.imshow(downsample(drawed_image))
             ax2.grid(False)
             ax2.set_axis_off()
 
-            st.pyplot(fig)
+            return fig
+
+        with st.spinner("Rendering images..."), tracing.span("render.prediction"):
+            figure = figure_key(
+                "prediction",
+                PREDICTION_FIGURE_VERSION,
+                model_digest,
+                image_digest,
+                confidence,
+                pred_mask_type,
+            )
+            st.image(cached_figure(figure, render_prediction))
+
+# Opt-in views, outside the Predict button so ticking them does not hide them on the rerun
+if st.sidebar.checkbox(
+    "Full-resolution overlay", help="Decode the whole image and draw the prediction on it"
+):
+    with st.spinner("Drawing full-resolution overlay..."), tracing.span("render.overlay"):
+        st.image(draw_prediction(read_image(selected_image), components))
+
+if st.sidebar.checkbox("🗺️ Interactive map", help="Pan and zoom over the full-resolution image"):
+    # Tiles of the image and of the cached probability map, on the image's pixel grid
+    tile_url = serve_tiles()
+    layers = {
+        "Image": f"{tile_url}/drone/{quote(image_name)}/{{z}}/{{x}}/{{y}}.png",
+        "Prediction": (
+            f"{tile_url}/prediction/{prediction_key(model_digest, image_digest)}/{confidence}"
+            "/{z}/{x}/{y}.png"
+        ),
+    }
+    shape = image_shape(selected_image)
+    height, width = shape
+    st.components.v1.html(
+        leaflet_html(layers, (0, 0, width, height), pixel_max_zoom(shape), pixel_grid=True),
+        height=620,
+    )
+
+tracing.finish_trace()
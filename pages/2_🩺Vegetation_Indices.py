@@ -1,20 +1,33 @@
-import glob
 import os
+from urllib.parse import quote
 
-import geopandas as gpd  # type: ignore
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import rasterio  # type: ignore
 import streamlit as st
+import streamlit.components.v1 as components
 from rasterio.plot import show  # type: ignore
-from rasterstats import zonal_stats  # type: ignore
+from rasterio.windows import Window  # type: ignore
+from shapely.geometry import box  # type: ignore
+
+from tree_tracker import tracing
+from tree_tracker.cog import display_shape, display_transform
+from tree_tracker.datasets import path_fingerprint, registry
+from tree_tracker.figures import cached_figure, figure_key
+from tree_tracker.index_catalog import STAT_COLUMNS, update_catalog
+from tree_tracker.indices import INDICES, read_indices
+from tree_tracker.parcels import PARCELS_PATH
+from tree_tracker.scenes import scan_fingerprint, scan_scenes
+from tree_tracker.tiles import leaflet_html, serve_tiles
+from tree_tracker.zonal import parcel_time_series, parcel_window
 
 st.set_page_config(
     layout="wide",
     page_title="Tree Tracker | Vegetation Indices",
     page_icon="static/bondy-logo.png",
 )
+tracing.start_trace("Vegetation Indices", profile=tracing.profile_requested())
 st.markdown(
     """
 <style>
@@ -43,165 +56,21 @@ div[data-testid="metric-container"] > label[data-testid="stMetricLabel"] > div {
 )
 
 
-def calculate_ndvi(src):
-    # Allow division by zero
-    np.seterr(divide="ignore", invalid="ignore")
-
-    band_red = src.read(3)
-    band_nir = src.read(4)
-
-    return (band_nir.astype(float) - band_red.astype(float)) / (band_nir + band_red)
-
-
-def calculate_ndwi(src):
-    # Allow division by zero
-    np.seterr(divide="ignore", invalid="ignore")
-    band_green = src.read(2)
-    band_nir = src.read(4)
-
-    return (band_green.astype(float) - band_nir.astype(float)) / (band_green + band_nir)
-
-
-def calculate_msavi2(src):
-    # Allow division by zero
-    np.seterr(divide="ignore", invalid="ignore")
-    _ = src.read(2)
-    band_red = src.read(3)
-    band_nir = src.read(4)
-
-    # 2∗ir+1
-    msavi2_first = 2 * band_nir.astype(float) + 1
-
-    # 8(ir−r)
-    msavi2_second = 8 * (band_nir.astype(float) - band_red.astype(float))
-
-    return (msavi2_first - np.sqrt(np.square(msavi2_first) - msavi2_second)) / 2
-
-
-def makeParcelNameList(df):
-    parcelNameList = []
-    for index, row in df.iterrows():
-        if row["plotName"] is None:
-            if row["name"] is None:
-                print("none")
-            if len(row["name"]) == 0:
-                parcelFolder = row["folders"].split("; ")
-                n = len(parcelFolder)
-                if n > 1:
-                    n = -n + 1
-                    parcelName = ", ".join(parcelFolder[n:])
-                else:
-                    parcelName = parcelFolder
-
-            else:
-                parcelName = row["name"]
-        else:
-            parcelName = row["plotName"]
-
-        parcelName = str(index) + " | " + parcelName
-        parcelNameList.append(parcelName)
-
-    return parcelNameList
-
-
-def get_parcel_stats(parcel_polygon, selected_index):
-    parcel_polygon = parcel_polygon.to_crs(crs=selected_index.crs)
-    ndval = 1
-    # get the matrix:
-    array = selected_index.read(1)
-    array = array.astype("float64")
-    array[array == ndval] = np.nan
-
-    affine = selected_index.transform
-
-    # get the stats
-    zs_parcel_polygon = zonal_stats(
-        parcel_polygon, array, affine=affine, nodata=np.nan, stats=["min", "max", "mean"]
-    )
-
-    # bring the stats to the load_data function
-    return zs_parcel_polygon
+@st.cache_resource
+def load_scene_catalog(fingerprint):
+    # Rescanned only when a region or scene is added to or removed from data/planet
+    return scan_scenes("data/planet")
 
 
 @st.cache_data
-def load_data():
-    data_path = r"data/planet"
-
-    # Create a metrics dataframe
-    df_metrics = pd.DataFrame(
-        columns=[
-            "year",
-            "month",
-            "region",
-            "NDVI_min",
-            "NDVI_max",
-            "NDVI_average",
-            "NDWI_min",
-            "NDWI_max",
-            "NDWI_average",
-            "MSAVI2_min",
-            "MSAVI2_max",
-            "MSAVI2_average",
-        ]
-    )
-    # Read all the regions
-    region_list = ["Andramasina", "Antolojanahary"]
-    for region in region_list:
-        tif_path = os.path.join(data_path, region)
-        file_list = glob.glob(tif_path + "/*clip.tif")
-
-        for file_ in file_list:
-            image_file = rasterio.open(file_)
-            with image_file as src:
-                string_end = "_clip.tif"
-                len_string_end = len(string_end)
-                len_month = 2
-                len_year = 4
-                extra = 1
-
-                len_remove = len_string_end + len_month + len_year + extra
-
-                file_path_s1 = file_[-len_remove:-len_string_end]
-
-                split_text = file_path_s1.split("-")
-
-                year = split_text[0]
-                month = split_text[1]
-
-                # Calculate NDVI - check if you can change to after the dashboard loads
-                ndvi = calculate_ndvi(src)
-                min_ndvi = np.nanmin(ndvi)
-                max_ndvi = np.nanmax(ndvi)
-                avg_ndvi = np.nanmean(ndvi)
-
-                ndwi = calculate_ndwi(src)
-                min_ndwi = np.nanmin(ndwi)
-                max_ndwi = np.nanmax(ndwi)
-                avg_ndwi = np.nanmean(ndwi)
-
-                msavi2 = calculate_msavi2(src)
-                min_msavi2 = np.nanmin(msavi2)
-                max_msavi2 = np.nanmax(msavi2)
-                avg_msavi2 = np.nanmean(msavi2)
-
-                series_list = [
-                    year,
-                    month,
-                    region,
-                    min_ndvi,
-                    max_ndvi,
-                    avg_ndvi,
-                    min_ndwi,
-                    max_ndwi,
-                    avg_ndwi,
-                    min_msavi2,
-                    max_msavi2,
-                    avg_msavi2,
-                ]
-                # Append calculated metrics to df
-                df_tmp = pd.Series(series_list, index=df_metrics.columns)
-                length_df = len(df_metrics)
-                df_metrics.loc[length_df] = df_tmp
+def load_data(_scene_catalog, fingerprint):
+    df_scenes = pd.DataFrame(_scene_catalog.scenes[["path", "region", "date"]])
+    df_scenes["year"] = df_scenes["date"].dt.strftime("%Y")
+    df_scenes["month"] = df_scenes["date"].dt.strftime("%m")
+
+    # Index statistics come from the on-disk catalog, only new or changed scenes are computed
+    df_stats = update_catalog(df_scenes["path"].tolist())
+    df_metrics = df_scenes.drop(columns="date").merge(df_stats[["path"] + STAT_COLUMNS], on="path")
 
     df_metrics["label"] = df_metrics["year"].map(str) + "-" + df_metrics["month"].map(str)
     df_metrics = df_metrics.sort_values(by=["year", "month"])
@@ -213,18 +82,25 @@ def load_data():
     return df_metrics
 
 
-path_parcels = "data/parcel/BondyPlantedParcels.geojson"
-gdf_BondyPlantedParcels = gpd.read_file(path_parcels)
+@st.cache_data
+def load_parcel_data(_scene_catalog, fingerprint, _parcels, parcels_fingerprint):
+    # Per-parcel statistics of the scenes covering the parcels, rasterised once per scene grid,
+    # recomputed when the scenes or the parcels GeoJSON change
+    parcel_area = box(*_parcels.to_crs(4326).total_bounds)
+    return parcel_time_series(_scene_catalog.query(geometry=parcel_area)["path"], _parcels)
+
+
+# Shared by every session, read once per process and reread when the file changes
+parcel_store = registry.get("parcels")
 
 # Regions
 selected_region = st.sidebar.selectbox(
     "🌍 Regions",
-    gdf_BondyPlantedParcels["regionName"].unique(),
+    parcel_store.regions,
     help="Select region available from GeoJSON file",
 )
 
-rslt_df = gdf_BondyPlantedParcels[gdf_BondyPlantedParcels["regionName"].isin([selected_region])]
-list_parcels = makeParcelNameList(rslt_df)
+list_parcels = parcel_store.region_labels(selected_region)
 
 # Parcels
 selected_parcel = st.sidebar.selectbox("📍 Parcels", list_parcels) or list_parcels[0]
@@ -236,7 +112,9 @@ head_col, metric_col, month_year_col = st.columns([5, 2, 2])
 vegetation_metric = (
     metric_col.selectbox("🔎 Select a metric to plot", ["NDVI", "NDWI", "MSAVI2"]) or "NVDI"
 )
-df_metrics = load_data()
+planet_fingerprint = scan_fingerprint("data/planet")
+scene_catalog = load_scene_catalog(planet_fingerprint)
+df_metrics = load_data(scene_catalog, planet_fingerprint)
 # st.dataframe(df_metrics)
 
 month_year = month_year_col.selectbox("📅 Select Month & Year", df_metrics["label"].unique())
@@ -273,77 +151,166 @@ with st.spinner("Calculating indices...."):
     st.subheader(f"{vegetation_metric} : By time and region")
     col_5, col_6 = st.columns(2)
 
-    image_file = rasterio.open(
-        f"data/planet/{selected_region}/planet_medres_normalized_analytic_{month_year}_clip.tif"
+    map_selection = st.sidebar.selectbox("Select map area", ["Region", "Parcel"])
+    interactive_map = st.sidebar.checkbox(
+        "🗺️ Interactive map", help="Pan and zoom over the index tiles of the whole scene"
     )
-
-    with image_file as src:
+    scene_path = scene_catalog.scene(selected_region, month_year)
+    if scene_path is None:
+        st.warning(f"No {month_year} scene available for {selected_region}")
+        tracing.finish_trace()
+        st.stop()
+    with rasterio.open(scene_path) as src:
         meta = src.meta.copy()
         # st.write(meta)
-
-        # Calculate metric
-        metric_data = {
-            "NDVI": calculate_ndvi(src),
-            "NDWI": calculate_ndwi(src),
-            "MSAVI2": calculate_msavi2(src),
-        }
-
-    # Plot the metric values over time
-    fig, axes = plt.subplots(figsize=(12, 3))
-    plt.fill_between(
-        x=df_metrics["label"],
-        y1=np.array(df_metrics[f"{vegetation_metric}_min"].to_list()),
-        y2=df_metrics[f"{vegetation_metric}_max"].to_list(),
-        alpha=0.2,
-        color="green",
+        scene_bounds = src.bounds
+
+        # Only the selected parcel's window is read in the parcel view
+        read_window = Window(0, 0, src.width, src.height)
+        if map_selection == "Parcel":
+            parcel_bounds = parcel_store.to_crs(src.crs.to_string()).iloc[[parcelID]].total_bounds
+            parcel_read_window = parcel_window(src, tuple(parcel_bounds))
+            if parcel_read_window is None:
+                st.warning(f"{parcel_name} is outside this scene, showing the whole region")
+            else:
+                read_window = parcel_read_window
+
+        # Calculate metric at the overview level that fits the 10 inch maps
+        read_shape = display_shape(read_window)
+        read_transform = display_transform(src, read_window, read_shape)
+
+    metric_data = {}
+
+    def read_metric():
+        # Read only when a map is not in the figure cache, once for both maps
+        if not metric_data:
+            with rasterio.open(scene_path) as src:
+                arrays, _ = read_indices(
+                    src, [vegetation_metric], window=read_window, out_shape=read_shape
+                )
+            metric_data.update(arrays)
+        return metric_data[vegetation_metric]
+
+    # Maps are keyed by the scene file, the metric and the displayed window
+    map_view = (
+        scene_path,
+        path_fingerprint(scene_path),
+        vegetation_metric,
+        read_window,
+        read_shape,
     )
-    plt.plot(df_metrics["label"], df_metrics[vegetation_metric + "_average"], color="green")
-    plt.xticks(rotation=90)
-    plt.title(vegetation_metric + " with time")
-    plt.axvline(x=month_year, color="black", linestyle=":")
-    st.pyplot(fig)
-
-    gdf_BondyPlantedParcels = gdf_BondyPlantedParcels.to_crs("WGS84")
 
-    geodf = gdf_BondyPlantedParcels
+    # Plot the metric values of the selected parcel over time, whole scenes if it is not covered
+    df_parcels = load_parcel_data(
+        scene_catalog, planet_fingerprint, parcel_store.parcels, path_fingerprint(PARCELS_PATH)
+    )
+    df_series = df_parcels[df_parcels["parcel"] == parcelID].merge(
+        df_metrics[["path", "label"]], on="path"
+    )
+    df_series = df_series.sort_values(by="label")
+    series_title = f"{vegetation_metric} with time | {parcel_name}"
+    if df_series.empty:
+        df_series = df_metrics
+        series_title = vegetation_metric + " with time"
+
+    def render_series():
+        fig, axes = plt.subplots(figsize=(12, 3))
+        plt.fill_between(
+            x=df_series["label"],
+            y1=np.array(df_series[f"{vegetation_metric}_min"].to_list()),
+            y2=df_series[f"{vegetation_metric}_max"].to_list(),
+            alpha=0.2,
+            color="green",
+        )
+        plt.plot(df_series["label"], df_series[vegetation_metric + "_average"], color="green")
+        plt.xticks(rotation=90)
+        plt.title(series_title)
+        plt.axvline(x=month_year, color="black", linestyle=":")
+        return fig
+
+    with tracing.span("render.index_series"):
+        series_columns = ["label"] + [f"{vegetation_metric}_{s}" for s in ("min", "max", "average")]
+        figure = figure_key(
+            "index_series",
+            series_title,
+            month_year,
+            pd.util.hash_pandas_object(df_series[series_columns], index=False).sum(),
+        )
+        st.image(cached_figure(figure, render_series))
+
+    geodf = parcel_store.parcels
     min_x, min_y, max_x, max_y = geodf.iloc[parcelID].geometry.bounds
     lat_new = (min_y + max_y) / 2
     lon_new = (min_x + max_x) / 2
 
     # st.write(geodf.crs)
     # Displaying the selected metric
-    fig, axes = plt.subplots(figsize=(10, 10))
-    img = axes.imshow(
-        metric_data[vegetation_metric],
-        cmap="viridis",
-        interpolation="none",
-    )
-    axes.set(title=vegetation_metric)
-    # axes.set_xlim([10, 20])
-    # axes.set_ylim([400, 450])
-    axes.invert_yaxis()
-
-    # plt.colorbar(img, fraction=0.035, pad=0.025)
-    plt.grid(False)
-    col_6.pyplot(fig)
-
-    map_selection = st.sidebar.selectbox("Select map area", ["Region", "Parcel"])
-    geodf = geodf.to_crs(3857)
-    fig, ax = plt.subplots(figsize=(10, 10))
-    img = show(metric_data[vegetation_metric], cmap="viridis", aspect="auto")
-    ax.set(title="Boundary/Boundaries")
-    # ax.scatter(x=[30, 40], y=[50, 60], c='r', s=40)
-    geodf.plot(edgecolor="red", facecolor="None", linewidth=1, ax=ax)
-
+    def render_index_map():
+        fig, axes = plt.subplots(figsize=(10, 10))
+        img = axes.imshow(  # noqa: F841
+            read_metric(),
+            cmap="viridis",
+            interpolation="none",
+        )
+        axes.set(title=vegetation_metric)
+        # axes.set_xlim([10, 20])
+        # axes.set_ylim([400, 450])
+        axes.invert_yaxis()
+
+        # plt.colorbar(img, fraction=0.035, pad=0.025)
+        plt.grid(False)
+        return fig
+
+    with tracing.span("render.index_map"):
+        col_6.image(cached_figure(figure_key("index_map", *map_view), render_index_map))
+
+    geodf = parcel_store.to_crs(3857)
     if map_selection == "Region":
-        min_x, min_y, max_x, max_y = src.bounds
+        min_x, min_y, max_x, max_y = scene_bounds
     else:
         min_x, min_y, max_x, max_y = geodf.iloc[parcelID].geometry.bounds
 
-    ax.set_xlim((min_x, max_x))
-    ax.set_ylim((min_y, max_y))
-    ax.invert_yaxis()
-    ax.grid(False)
-
-    col_5.pyplot(fig)
+    def render_boundary_map():
+        fig, ax = plt.subplots(figsize=(10, 10))
+        show(read_metric(), transform=read_transform, cmap="viridis", aspect="auto")
+        ax.set(title="Boundary/Boundaries")
+        # ax.scatter(x=[30, 40], y=[50, 60], c='r', s=40)
+        # Only the boundaries in view are drawn
+        geodf.cx[min_x:max_x, min_y:max_y].plot(
+            edgecolor="red", facecolor="None", linewidth=1, ax=ax
+        )
+
+        ax.set_xlim((min_x, max_x))
+        # The raster is drawn georeferenced, north up, like the boundaries
+        ax.set_ylim((min_y, max_y))
+        ax.grid(False)
+        return fig
+
+    with tracing.span("render.boundary_map"):
+        figure = figure_key(
+            "boundary_map", *map_view, path_fingerprint(PARCELS_PATH), (min_x, min_y, max_x, max_y)
+        )
+        col_5.image(cached_figure(figure, render_boundary_map))
     # st.write(geodf)
+
+    if interactive_map:
+        # Tiles are rendered on demand by the local tile server, from the scene's overviews
+        tile_url = serve_tiles()
+        scene_dir, scene_file = os.path.split(os.path.splitext(scene_path)[0])
+        scene_url = f"{tile_url}/planet/{quote(os.path.basename(scene_dir))}/{quote(scene_file)}"
+        layers = {
+            metric: f"{scene_url}/{metric}/{{z}}/{{x}}/{{y}}.png"
+            for metric in [vegetation_metric] + [m for m in INDICES if m != vegetation_metric]
+        }
+        region_parcels = parcel_store.parcels[parcel_store.parcels["regionName"] == selected_region]
+        if map_selection == "Parcel":
+            map_bounds = parcel_store.parcels.iloc[[parcelID]].total_bounds
+        else:
+            scenes = scene_catalog.scenes
+            map_bounds = scenes[scenes["path"] == scene_path].total_bounds
+        components.html(
+            leaflet_html(layers, tuple(map_bounds), geojson=region_parcels[["geometry"]].to_json()),
+            height=620,
+        )
+
+tracing.finish_trace()
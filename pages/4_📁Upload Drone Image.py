@@ -1,16 +1,17 @@
-from typing import Any, Literal
+import os
 
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from streamlit.delta_generator import DeltaGenerator
 
-from tree_tracker import util
+from tree_tracker import tracing, util
 
 st.set_page_config(
     layout="wide",
     page_title="Tree Tracker | Upload Drone Image",
     page_icon="static/bondy-logo.png",
 )
+tracing.start_trace("Upload Drone Image", profile=tracing.profile_requested())
 
 st.header("📁 Upload Drone Image")
 col2: DeltaGenerator = st.columns([1, 3, 1])[1]
@@ -23,17 +24,32 @@ with col2.form("upload_form"):
     # Every form must have a submit button.
     submitted: bool = st.form_submit_button("Upload")
     if submitted:
-        if drone_image is not None:
-            status: list[Any] = []
-            for image in drone_image:
-                with st.spinner("Uploading..."):
-                    _image: str | Literal[False] | None = util.save_upload(image, "drone")
-                    if _image:
-                        status.append(util.upload_data(_image, "drone"))
-
-            if all(status):
+        if drone_image:
+            progress_bar = st.progress(0.0, text="Uploading...")
+
+            def show_progress(sent: int, total: int) -> None:
+                progress_bar.progress(sent / total if total else 1.0, text="Uploading...")
+
+            # Streamed from memory, several files and parts in parallel
+            results: list[util.UploadResult] = util.upload_buffers(
+                [(image.name, image.getbuffer()) for image in drone_image],
+                "drone",
+                progress=show_progress,
+            )
+            progress_bar.empty()
+
+            duplicates: list[util.UploadResult] = [r for r in results if r.status == "duplicate"]
+            for result in duplicates:
+                st.info(f"{result.name} is already stored as {result.key}")
+            for result in results:
+                if result.status == "uploaded" and os.path.basename(result.key) != result.name:
+                    st.info(f"Another image is named {result.name}, stored as {result.key}")
+
+            if all(result.status != "failed" for result in results):
                 st.success("Image uploaded successfully")
             else:
                 st.error("Image upload failed")
         else:
             st.error("No image selected")
+
+tracing.finish_trace()
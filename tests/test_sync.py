@@ -0,0 +1,142 @@
+import os
+
+import boto3  # type: ignore
+import pytest
+from boto3.s3.transfer import TransferConfig  # type: ignore
+from moto import mock_aws
+
+from tree_tracker.util import UPLOAD_OPTIONS, read_manifest, s3_etag, sync_data
+
+BUCKET = "tree-tracker-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def sync(s3, tmp_path):
+    data_dir = tmp_path / "data"
+    manifest_path = tmp_path / "data" / ".s3_manifest.json"
+
+    def run(prefix="model/"):
+        return sync_data(
+            prefix,
+            data_dir=str(data_dir),
+            bucket=BUCKET,
+            workers=4,
+            manifest_path=str(manifest_path),
+            client=s3,
+        )
+
+    run.data_dir = data_dir
+    run.manifest_path = str(manifest_path)
+    return run
+
+
+def test_sync_downloads_new_objects_once(s3, sync):
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"a" * 100)
+    s3.put_object(Bucket=BUCKET, Key="model/site/b.onnx", Body=b"b" * 200)
+    s3.put_object(Bucket=BUCKET, Key="model/site/", Body=b"")
+    s3.put_object(Bucket=BUCKET, Key="drone/c.jpg", Body=b"c")
+
+    stats = sync()
+    assert stats.downloaded == 2
+    assert stats.failed == []
+    assert stats.bytes == 300
+    assert (sync.data_dir / "model" / "site" / "b.onnx").read_bytes() == b"b" * 200
+    assert not (sync.data_dir / "drone").exists()
+
+    stats = sync()
+    assert stats.downloaded == 0
+    assert stats.skipped == 2
+
+
+def test_manifest_round_trip(s3, sync):
+    assert read_manifest(sync.manifest_path) == {}
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"a" * 100)
+    s3.put_object(Bucket=BUCKET, Key="drone/c.jpg", Body=b"c")
+    sync()
+
+    manifest = read_manifest(sync.manifest_path)
+    head = s3.head_object(Bucket=BUCKET, Key="model/a.onnx")
+    entry = manifest["model/a.onnx"]
+    assert entry["etag"] == head["ETag"]
+    assert entry["size"] == 100
+    assert entry["mtime_ns"] == os.stat(sync.data_dir / "model" / "a.onnx").st_mtime_ns
+    assert not [name for name in os.listdir(sync.data_dir / "model") if name.endswith(".part")]
+
+    # Syncing another prefix keeps the entries of this one
+    sync("drone/")
+    updated = read_manifest(sync.manifest_path)
+    assert set(updated) == {"model/a.onnx", "drone/c.jpg"}
+    assert updated["model/a.onnx"] == entry
+    assert sync("model/").skipped == 1
+
+
+def test_sync_downloads_changed_objects(s3, sync):
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"old")
+    s3.put_object(Bucket=BUCKET, Key="model/b.onnx", Body=b"same")
+    sync()
+
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"new")
+    stats = sync()
+    assert stats.downloaded == 1
+    assert stats.skipped == 1
+    assert (sync.data_dir / "model" / "a.onnx").read_bytes() == b"new"
+    head = s3.head_object(Bucket=BUCKET, Key="model/a.onnx")
+    assert read_manifest(sync.manifest_path)["model/a.onnx"]["etag"] == head["ETag"]
+
+
+def test_sync_redownloads_modified_local_copies(s3, sync):
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"remote")
+    sync()
+
+    (sync.data_dir / "model" / "a.onnx").write_bytes(b"edited locally")
+    assert sync().downloaded == 1
+    assert (sync.data_dir / "model" / "a.onnx").read_bytes() == b"remote"
+
+
+def test_sync_forgets_deleted_objects(s3, sync):
+    s3.put_object(Bucket=BUCKET, Key="model/a.onnx", Body=b"a")
+    s3.put_object(Bucket=BUCKET, Key="model/b.onnx", Body=b"b")
+    sync()
+
+    s3.delete_object(Bucket=BUCKET, Key="model/a.onnx")
+    stats = sync()
+    assert stats.downloaded == 0
+    assert set(read_manifest(sync.manifest_path)) == {"model/b.onnx"}
+    # The local copy is kept, only the bucket forgot it
+    assert (sync.data_dir / "model" / "a.onnx").exists()
+
+
+def test_sync_multipart_objects(s3, sync, tmp_path):
+    data = os.urandom(2 * UPLOAD_OPTIONS["multipart_chunksize"] + 1024)
+    source = tmp_path / "big.onnx"
+    source.write_bytes(data)
+    s3.upload_file(
+        str(source),
+        BUCKET,
+        "model/big.onnx",
+        Config=TransferConfig(
+            multipart_threshold=UPLOAD_OPTIONS["multipart_threshold"],
+            multipart_chunksize=UPLOAD_OPTIONS["multipart_chunksize"],
+        ),
+    )
+
+    # Composite ETag of the three parts, as computed locally before uploads
+    etag = s3.head_object(Bucket=BUCKET, Key="model/big.onnx")["ETag"]
+    assert etag.endswith('-3"')
+    assert s3_etag(data) == etag
+
+    assert sync().downloaded == 1
+    assert (sync.data_dir / "model" / "big.onnx").read_bytes() == data
+    assert read_manifest(sync.manifest_path)["model/big.onnx"]["etag"] == etag
+    assert sync().skipped == 1
@@ -0,0 +1,5 @@
+import sys
+
+from tree_tracker.cli import main
+
+sys.exit(main())
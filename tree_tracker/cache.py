@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from collections.abc import Callable
+
+import numpy as np
+
+from tree_tracker.inference import IMAGE_SIZE, TILE_OVERLAP
+
+# Cache location and size budget, shared by the dashboard and the batch CLI
+CACHE_DIR: str = os.getenv("PREDICTION_CACHE_DIR", "data/cache/predictions")
+CACHE_BYTES = int(os.getenv("PREDICTION_CACHE_BYTES", 2 * 1024**3))
+
+# Probabilities are stored at half precision, ample for 0.01 threshold steps
+CACHE_DTYPE = np.float16
+
+
+# Function to build the cache key of a prediction
+def prediction_key(model_digest: str, image_digest: str) -> str:
+    """
+    Build the content-addressed key of a probability map
+
+    :param model_digest: SHA-256 of the model file
+    :param image_digest: SHA-256 of the image file
+    :return: Hex key, also covering the tiling parameters
+    """
+
+    parts = [model_digest, image_digest, IMAGE_SIZE, TILE_OVERLAP]
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.npz")
+
+
+# Function to load a cached probability map
+def load_prediction(key: str) -> np.ndarray | None:
+    """
+    Load a probability map from the cache and mark it as recently used
+
+    :param key: Prediction key
+    :return: Probability map, or None on a miss
+    """
+
+    path = _entry_path(key)
+    try:
+        with np.load(path) as entry:
+            prob = entry["prob"]
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # Truncated or foreign file, drop it and recompute
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    return prob
+
+
+# Function to evict least recently used entries
+def evict(budget: int | None = None, cache_dir: str | None = None, suffix: str = ".npz") -> int:
+    """
+    Remove the least recently used entries until the cache fits its budget
+
+    :param budget: Size budget in bytes, defaults to CACHE_BYTES
+    :param cache_dir: Cache directory, defaults to CACHE_DIR
+    :param suffix: Extension of the entries
+    :return: Number of bytes freed
+    """
+
+    budget = CACHE_BYTES if budget is None else budget
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR if cache_dir is None else cache_dir):
+        for name in files:
+            if not name.endswith(suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, path in sorted(entries):
+        if total - freed <= budget:
+            break
+        try:
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+
+    return freed
+
+
+# Function to store a probability map in the cache
+def store_prediction(key: str, prob: np.ndarray) -> None:
+    """
+    Store a probability map compressed on disk, then enforce the size budget
+
+    :param key: Prediction key
+    :param prob: Probability map
+    """
+
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, prob=prob.astype(CACHE_DTYPE))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    evict()
+
+
+# Function to fetch a probability map, computing it on a miss
+def cached_prediction(key: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+    """
+    Return the cached probability map for a key, computing and storing it on a miss
+
+    :param key: Prediction key
+    :param compute: Callable producing the probability map
+    :return: Probability map at the cache precision
+    """
+
+    prob = load_prediction(key)
+    if prob is None:
+        prob = compute().astype(CACHE_DTYPE)
+        store_prediction(key, prob)
+
+    return prob
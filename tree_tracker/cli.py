@@ -0,0 +1,499 @@
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any
+
+import numpy as np
+
+from tree_tracker import inference, tracing, util
+from tree_tracker.cache import CACHE_DTYPE, cached_prediction, prediction_key
+from tree_tracker.inference import get_session, predict_tiled
+from tree_tracker.meteor import DAILY_PATH, STORE_PATH, build_daily, ingest_grib
+from tree_tracker.quantize import (
+    CALIBRATION_DIR,
+    CALIBRATION_IMAGES,
+    EVALUATION_IMAGES,
+    VARIANTS,
+)
+
+# cv2 (prediction) and rasterio (cog, index_catalog) are imported by the commands using them
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+METRIC_FIELDS = [
+    "image",
+    "model",
+    "height",
+    "width",
+    "patches",
+    "mean_patch_m2",
+    "num_tree",
+    "veg_percent",
+    "seconds",
+    "error",
+]
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 256
+
+
+class MetricsWriter:
+    """
+    Stream per-image metric rows to a CSV or Parquet file
+
+    The format is chosen from the file extension. CSV rows are flushed as they
+    arrive, Parquet rows are written in row groups of PARQUET_ROW_GROUP rows.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._parquet = path.lower().endswith(".parquet")
+        self._rows: list[dict[str, Any]] = []
+        self._writer: Any = None
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if not self._parquet:
+            self._file = open(path, "w", newline="")
+            self._writer = csv.DictWriter(self._file, fieldnames=METRIC_FIELDS)
+            self._writer.writeheader()
+
+    def _flush_parquet(self) -> None:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+
+        table = pa.Table.from_pylist(self._rows, schema=_parquet_schema())
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def write(self, row: dict[str, Any]) -> None:
+        if self._parquet:
+            self._rows.append(row)
+            if len(self._rows) >= PARQUET_ROW_GROUP:
+                self._flush_parquet()
+        else:
+            self._writer.writerow(row)
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._parquet:
+            if self._rows or self._writer is None:
+                self._flush_parquet()
+            self._writer.close()
+        else:
+            self._file.close()
+
+    def __enter__(self) -> "MetricsWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def _parquet_schema() -> Any:
+    import pyarrow as pa  # type: ignore
+
+    return pa.schema(
+        [
+            ("image", pa.string()),
+            ("model", pa.string()),
+            ("height", pa.int64()),
+            ("width", pa.int64()),
+            ("patches", pa.int64()),
+            ("mean_patch_m2", pa.float64()),
+            ("num_tree", pa.int64()),
+            ("veg_percent", pa.float64()),
+            ("seconds", pa.float64()),
+            ("error", pa.string()),
+        ]
+    )
+
+
+# Function to list the images of a directory or S3 prefix
+def list_images(source: str) -> list[str]:
+    """
+    List the images to score
+
+    :param source: Local directory or s3://bucket/prefix
+    :return: Sorted image paths or s3:// URIs
+    """
+
+    if source.startswith("s3://"):
+        bucket, _, prefix = source[len("s3://") :].partition("/")
+        keys = util.list_objects(prefix, bucket)
+        return sorted(
+            f"s3://{bucket}/{key}" for key in keys if key.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    return sorted(
+        os.path.join(source, name)
+        for name in os.listdir(source)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def _load_image(source: str) -> tuple[Any, str]:
+    from tree_tracker.prediction import decode_image, read_image
+
+    if source.startswith("s3://"):
+        bucket, _, key = source[len("s3://") :].partition("/")
+        data = util.read_object(key, bucket)
+        return decode_image(data), hashlib.sha256(data).hexdigest()
+    return read_image(source), util.file_digest(source)
+
+
+def _init_worker(threads: int) -> None:
+    # Split the cores between workers instead of letting every session grab all of them
+    inference.INTRA_OP_THREADS = threads
+    # Listing the images built the S3 resource before the fork, do not share its connections
+    util._s3.cache_clear()
+
+
+# Function to run the Model Prediction pipeline on one image
+def predict_image(
+    image_path: str,
+    model_path: str,
+    confidence: float,
+    gsd: float,
+    tree_size_in_meters: float,
+    use_cache: bool = True,
+) -> dict[str, Any]:
+    """
+    Run preprocessing, inference, thresholding and counting on one image
+
+    :param image_path: Local image path or s3:// URI
+    :param model_path: Path to the .onnx model
+    :param confidence: Confidence threshold
+    :param gsd: Ground Sampling Distance (m)
+    :param tree_size_in_meters: Tree size (m)
+    :param use_cache: Reuse probability maps from the prediction cache
+    :return: Metric row for the image
+    """
+
+    from tree_tracker.prediction import connected_components, mask_metrics
+
+    start = time.perf_counter()
+    image, image_digest = _load_image(image_path)
+    if use_cache:
+        key = prediction_key(util.file_digest(model_path), image_digest)
+        pred_prob = cached_prediction(key, lambda: predict_tiled(get_session(model_path), image))
+    else:
+        # Same precision as a cache hit, so both paths threshold to the same mask
+        pred_prob = predict_tiled(get_session(model_path), image).astype(CACHE_DTYPE)
+    pred_mask = (pred_prob > confidence).astype(np.uint8)
+
+    # Counting only needs the components, nothing is drawn in batch mode
+    components = connected_components(pred_mask)
+    veg_percent, num_tree = mask_metrics(pred_mask, gsd, tree_size_in_meters)
+
+    return {
+        "image": image_path,
+        "model": os.path.basename(model_path),
+        "height": image.shape[0],
+        "width": image.shape[1],
+        "patches": components.count,
+        "mean_patch_m2": float(components.areas.mean() * gsd**2) if components.count else 0.0,
+        "num_tree": num_tree,
+        "veg_percent": veg_percent,
+        "seconds": time.perf_counter() - start,
+        "error": None,
+    }
+
+
+def _predict(args: argparse.Namespace) -> int:
+    images = list_images(args.input)
+    if not images:
+        print(f"No images found in {args.input}", file=sys.stderr)
+        return 1
+
+    workers = max(1, min(args.workers, len(images)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    failed = 0
+    start = time.perf_counter()
+
+    with MetricsWriter(args.output) as writer, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(threads,)
+    ) as pool:
+        futures = {
+            pool.submit(
+                predict_image,
+                image,
+                args.model,
+                args.confidence,
+                args.gsd,
+                args.tree_size,
+                args.cache,
+            ): image
+            for image in images
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            image = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failed += 1
+                row = {"image": image, "model": os.path.basename(args.model), "error": str(e)}
+            writer.write({field: row.get(field) for field in METRIC_FIELDS})
+            print(f"[{done}/{len(images)}] {image}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Scored {len(images) - failed}/{len(images)} images in {elapsed:.1f}s "
+        f"({len(images) / elapsed:.2f} images/s) -> {args.output}",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+def _catalog(args: argparse.Namespace) -> int:
+    from tree_tracker.index_catalog import CATALOG_PATH, update_catalog
+
+    output = args.output or CATALOG_PATH
+    paths = sorted(glob.glob(os.path.join(args.input, "*", "*clip.tif")))
+    start = time.perf_counter()
+    catalog = update_catalog(paths, output, workers=args.workers, rebuild=args.rebuild)
+    print(
+        f"Catalogued {len(catalog)} scenes in {time.perf_counter() - start:.1f}s -> {output}",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _cog(args: argparse.Namespace) -> int:
+    from tree_tracker.cog import ingest_planet
+
+    start = time.perf_counter()
+    converted = ingest_planet(args.input, force=args.force)
+    for path in converted:
+        print(f"Converted {path}", file=sys.stderr)
+    print(
+        f"Converted {len(converted)} scenes in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _meteor(args: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    steps = ingest_grib(args.input or None, store=args.store, append=args.append)
+    rows = build_daily(args.store, args.daily)
+    print(
+        f"Wrote {steps} time steps to {args.store} and {rows} daily rows to {args.daily} "
+        f"in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _sync(args: argparse.Namespace) -> int:
+    unknown = sorted(set(args.data) - set(util.DATA_TYPE))
+    if unknown:
+        print(f"Unknown data folders {unknown}, expected {util.DATA_TYPE}", file=sys.stderr)
+        return 2
+
+    failed = 0
+    for data in args.data or util.DATA_TYPE:
+        stats = util.sync_data(f"{data}/", workers=args.workers)
+        failed += len(stats.failed)
+        print(
+            f"{data}: {stats.downloaded} downloaded, {stats.skipped} up to date, "
+            f"{len(stats.failed)} failed, {stats.bytes / 2**20:.1f} MB in {stats.seconds:.1f}s "
+            f"({stats.mb_per_second:.1f} MB/s)",
+            file=sys.stderr,
+        )
+        for key in stats.failed:
+            print(f"Failed {key}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _tiles(args: argparse.Namespace) -> int:
+    from tree_tracker.tiles import TILE_PORT, serve_tiles
+
+    port = args.port or TILE_PORT
+    print(f"Serving tiles on port {port}, Ctrl+C to stop", file=sys.stderr)
+    try:
+        serve_tiles(port, block=True)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Cannot serve tiles on port {port}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _quantize(args: argparse.Namespace) -> int:
+    from tree_tracker import quantize
+
+    try:
+        import onnx  # type: ignore # noqa: F401
+    except ImportError:
+        print(
+            "Building model variants requires the onnx package (pip install onnx)", file=sys.stderr
+        )
+        return 2
+
+    calibration, evaluation = quantize.split_images(
+        list_images(args.calibration), args.images, args.eval_images
+    )
+    if not calibration or not evaluation:
+        print(
+            f"Need at least 2 drone images in {args.calibration}, "
+            "for calibration and for evaluation",
+            file=sys.stderr,
+        )
+        return 1
+
+    start = time.perf_counter()
+    report = quantize.optimise_model(
+        args.model, calibration, evaluation, args.variants, args.confidence
+    )
+    for variant, result in report["variants"].items():
+        if "error" in result:
+            print(f"{variant}: failed, {result['error']}", file=sys.stderr)
+            continue
+        print(
+            f"{variant}: {result['seconds']:.2f}s/image ({result['speedup']:.2f}x), "
+            f"{result['size_mb']:.1f} MB file, +{result['peak_rss_mb']:.0f} MB peak RSS, "
+            f"mask IoU {result['mask_iou']:.3f}, tree count drift {result['tree_drift']:+.1%}",
+            file=sys.stderr,
+        )
+    print(
+        f"Benchmarked {len(report['variants'])} models on {len(evaluation)} images in "
+        f"{time.perf_counter() - start:.1f}s -> {quantize.report_path(args.model)}",
+        file=sys.stderr,
+    )
+
+    if args.upload:
+        # The Model Prediction page lists the variants and their report from the bucket
+        paths = [
+            os.path.join(os.path.dirname(args.model), result["file"])
+            for variant, result in report["variants"].items()
+            if variant != quantize.REFERENCE and "error" not in result
+        ]
+        failed = [
+            path
+            for path in [*paths, quantize.report_path(args.model)]
+            if not util.upload_data(path, "model")
+        ]
+        for path in failed:
+            print(f"Failed to upload {path}", file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tree_tracker", description="Bondy Tree Tracker tools")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Capture a profile of the command into {tracing.PROFILE_DIR}",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    predict = commands.add_parser("predict", help="Score drone images with an ONNX model")
+    predict.add_argument("--model", required=True, help="Path to the .onnx model")
+    predict.add_argument(
+        "--input", default="data/drone", help="Image directory or s3://bucket/prefix"
+    )
+    predict.add_argument(
+        "--output", default="predictions.csv", help="Metrics file (.csv or .parquet)"
+    )
+    predict.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes"
+    )
+    predict.add_argument("--confidence", type=float, default=0.8, help="Confidence threshold")
+    predict.add_argument("--gsd", type=float, default=0.0013, help="Ground Sampling Distance (m)")
+    predict.add_argument("--tree-size", type=float, default=4.0, help="Tree size (m)")
+    predict.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="Always run the model instead of reusing cached probability maps",
+    )
+    predict.set_defaults(func=_predict)
+
+    catalog = commands.add_parser("catalog", help="Update the Planet index statistics catalog")
+    catalog.add_argument("--input", default="data/planet", help="Planet data directory")
+    catalog.add_argument(
+        "--output", help="Parquet catalog file, defaults to INDEX_CATALOG_PATH's setting"
+    )
+    catalog.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes"
+    )
+    catalog.add_argument(
+        "--rebuild", action="store_true", help="Recompute every scene instead of only changes"
+    )
+    catalog.set_defaults(func=_catalog)
+
+    cog = commands.add_parser("cog", help="Convert Planet scenes to COGs with overviews")
+    cog.add_argument("--input", default="data/planet", help="Planet data directory")
+    cog.add_argument("--force", action="store_true", help="Convert already optimised files")
+    cog.set_defaults(func=_cog)
+
+    meteor = commands.add_parser("meteor", help="Convert ERA5-Land GRIB files to a Zarr store")
+    meteor.add_argument("input", nargs="*", help="GRIB files, defaults to the ERA5-Land inputs")
+    meteor.add_argument("--store", default=STORE_PATH, help="Zarr store path")
+    meteor.add_argument("--daily", default=DAILY_PATH, help="Parquet file of daily aggregates")
+    meteor.add_argument(
+        "--append", action="store_true", help="Append time steps past the end of the store"
+    )
+    meteor.set_defaults(func=_meteor)
+
+    sync = commands.add_parser("sync", help="Download new or changed data from S3")
+    sync.add_argument(
+        "data", nargs="*", help=f"Data folders among {util.DATA_TYPE}, defaults to all of them"
+    )
+    sync.add_argument("--workers", type=int, default=util.SYNC_WORKERS, help="Parallel downloads")
+    sync.set_defaults(func=_sync)
+
+    tiles = commands.add_parser("tiles", help="Serve index and prediction map tiles")
+    tiles.add_argument("--port", type=int, help="HTTP port, defaults to TILE_PORT's setting")
+    tiles.set_defaults(func=_tiles)
+
+    quantize = commands.add_parser(
+        "quantize", help="Build and benchmark INT8 and FP16 variants of an ONNX model"
+    )
+    quantize.add_argument("--model", required=True, help="Path to the float32 .onnx model")
+    quantize.add_argument(
+        "--variants",
+        nargs="+",
+        choices=VARIANTS,
+        default=list(VARIANTS),
+        help="Variants to build",
+    )
+    quantize.add_argument(
+        "--calibration",
+        default=CALIBRATION_DIR,
+        help="Drone image directory, split into calibration and evaluation images",
+    )
+    quantize.add_argument(
+        "--images", type=int, default=CALIBRATION_IMAGES, help="Number of calibration images"
+    )
+    quantize.add_argument(
+        "--eval-images",
+        type=int,
+        default=EVALUATION_IMAGES,
+        help="Number of evaluation images, disjoint from the calibration ones",
+    )
+    quantize.add_argument(
+        "--confidence", type=float, default=0.8, help="Confidence threshold of compared masks"
+    )
+    quantize.add_argument(
+        "--upload", action="store_true", help="Upload the variants and their report to S3"
+    )
+    quantize.set_defaults(func=_quantize)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    with tracing.trace(f"cli {args.command}", profile=args.profile):
+        return args.func(args)
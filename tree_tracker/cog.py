@@ -0,0 +1,117 @@
+import glob
+import os
+from typing import Any
+
+import rasterio  # type: ignore
+import rasterio.shutil  # type: ignore
+from rasterio.enums import Resampling  # type: ignore
+from rasterio.transform import Affine  # type: ignore
+from rasterio.windows import Window  # type: ignore
+
+# Pixels along the longest side of a rendered map, a 10 inch figure at 100 dpi
+DISPLAY_PIXELS = 1000
+
+# Resampling used for decimated reads, GDAL serves them from the closest overview
+OVERVIEW_RESAMPLING = Resampling.average
+
+COG_OPTIONS: dict[str, Any] = {
+    "driver": "COG",
+    "blocksize": 512,
+    "compress": "DEFLATE",
+    "predictor": 2,
+    "overview_resampling": "average",
+}
+
+
+# Function to check if a GeoTIFF is already cloud optimised
+def is_cog(path: str) -> bool:
+    """
+    Check that a GeoTIFF is tiled and carries internal overviews
+
+    :param path: GeoTIFF file
+    :return: True if the file is tiled with overviews, else False
+    """
+
+    with rasterio.open(path) as src:
+        tiled = src.profile.get("tiled", False)
+        has_overviews = min(src.width, src.height) <= COG_OPTIONS["blocksize"] or bool(
+            src.overviews(1)
+        )
+
+    return bool(tiled) and has_overviews
+
+
+# Function to convert a GeoTIFF into a COG
+def convert_to_cog(path: str, force: bool = False) -> bool:
+    """
+    Rewrite a GeoTIFF in place as a tiled, compressed COG with internal overviews
+
+    :param path: GeoTIFF file
+    :param force: Convert even if the file already looks cloud optimised
+    :return: True if the file was converted, else False
+    """
+
+    if not force and is_cog(path):
+        return False
+
+    # Convert next to the source, then swap, so readers never see a partial file
+    tmp_path = f"{path}.cog.tmp"
+    try:
+        rasterio.shutil.copy(path, tmp_path, **COG_OPTIONS)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return True
+
+
+# Function to convert every Planet scene
+def ingest_planet(data_path: str = "data/planet", force: bool = False) -> list[str]:
+    """
+    Convert all Planet scenes under data/planet/<region>/ to COGs
+
+    :param data_path: Planet data directory
+    :param force: Convert even already optimised files
+    :return: Paths of the converted files
+    """
+
+    converted = []
+    for path in sorted(glob.glob(os.path.join(data_path, "*", "*_clip.tif"))):
+        if convert_to_cog(path, force=force):
+            converted.append(path)
+
+    return converted
+
+
+# Function to pick the read shape that fits the display
+def display_shape(window: Window, max_pixels: int = DISPLAY_PIXELS) -> tuple[int, int]:
+    """
+    Compute the output shape of a read that fits the display size
+
+    :param window: Raster window to display
+    :param max_pixels: Pixels along the longest displayed side
+    :return: (rows, cols), never larger than the window itself
+    """
+
+    height, width = int(window.height), int(window.width)
+    scale = min(1.0, max_pixels / max(height, width, 1))
+
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+# Function to get the transform of a decimated read
+def display_transform(src: Any, window: Window, shape: tuple[int, int]) -> Affine:
+    """
+    Compute the affine transform of a window read at a reduced shape
+
+    :param src: Open rasterio dataset
+    :param window: Raster window read
+    :param shape: (rows, cols) of the read
+    :return: Affine transform of the decimated array
+    """
+
+    return src.window_transform(window) * Affine.scale(
+        window.width / shape[1], window.height / shape[0]
+    )
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable, Hashable
+from typing import TYPE_CHECKING, Any
+
+from tree_tracker.meteor import STORE_PATH, open_store, store_fingerprint
+from tree_tracker.parcels import PARCELS_PATH, ParcelStore, load_parcels
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Function to fingerprint a file or directory
+def path_fingerprint(path: str) -> Hashable:
+    """
+    Cheap fingerprint of a file, changes when the file is rewritten
+
+    :param path: File or directory
+    :return: (mtime_ns, size), None if the path does not exist
+    """
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Function to estimate the memory held by a loaded dataset
+def resident_bytes(obj: Any) -> int:
+    """
+    Estimate the bytes a dataset holds in memory
+
+    The registry opens xarray datasets lazily, so only their indexes are counted,
+    data variables are read on demand and released by the callers.
+
+    :param obj: xarray Dataset, (Geo)DataFrame, ParcelStore or any other object
+    :return: Resident size in bytes
+    """
+
+    import pandas as pd
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, ParcelStore):
+        return sum(resident_bytes(gdf) for gdf in obj.projections())
+    if hasattr(obj, "indexes") and hasattr(obj, "data_vars"):
+        return sum(int(index.memory_usage(deep=True)) for index in obj.indexes.values())
+
+    return sys.getsizeof(obj)
+
+
+class _Entry:
+    def __init__(
+        self, path: str, loader: Callable[[str], Any], fingerprint: Callable[[str], Hashable]
+    ) -> None:
+        self.path = path
+        self.loader = loader
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.version: Hashable = None
+        self.value: Any = None
+        self.loaded_at: float | None = None
+        self.load_seconds: float | None = None
+
+
+class DatasetRegistry:
+    """
+    Process-wide registry of lazily opened datasets shared by every dashboard session
+
+    A dataset is opened on first use and kept until its file fingerprint changes,
+    then it is reopened once. The previous handle is left to sessions still using
+    it. Each dataset has its own lock, so slow opens do not block unrelated datasets.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        path: str,
+        loader: Callable[[str], Any],
+        fingerprint: Callable[[str], Hashable] = path_fingerprint,
+    ) -> None:
+        """
+        Register a dataset, replacing any previous registration of the name
+
+        :param name: Dataset name
+        :param path: File or store the dataset is opened from
+        :param loader: Function opening the path
+        :param fingerprint: Function fingerprinting the path, a change triggers a reload
+        """
+
+        with self._lock:
+            self._entries[name] = _Entry(path, loader, fingerprint)
+
+    def get(self, name: str) -> Any:
+        """
+        Get a dataset, opening or reopening it if needed
+
+        :param name: Dataset name
+        :return: Shared dataset, callers must not modify it in place
+        """
+
+        with self._lock:
+            entry = self._entries[name]
+
+        version = entry.fingerprint(entry.path)
+        with entry.lock:
+            if entry.loaded_at is None or entry.version != version:
+                start = time.perf_counter()
+                entry.value = entry.loader(entry.path)
+                # The loader may have created the file, fingerprint what was opened
+                entry.version = entry.fingerprint(entry.path)
+                entry.loaded_at = time.time()
+                entry.load_seconds = time.perf_counter() - start
+
+            return entry.value
+
+    def memory_usage(self) -> pd.DataFrame:
+        """
+        Report the registered datasets and the memory they hold
+
+        :return: One row per dataset with its path, load state, resident bytes and load time
+        """
+
+        import pandas as pd
+
+        with self._lock:
+            entries = dict(self._entries)
+
+        rows = []
+        for name, entry in entries.items():
+            with entry.lock:
+                loaded = entry.loaded_at is not None
+                rows.append(
+                    {
+                        "dataset": name,
+                        "path": entry.path,
+                        "loaded": loaded,
+                        "resident_mb": resident_bytes(entry.value) / 2**20 if loaded else 0.0,
+                        "loaded_at": pd.Timestamp(entry.loaded_at, unit="s") if loaded else None,
+                        "load_seconds": entry.load_seconds,
+                    }
+                )
+
+        return pd.DataFrame(
+            rows,
+            columns=["dataset", "path", "loaded", "resident_mb", "loaded_at", "load_seconds"],
+        )
+
+
+registry = DatasetRegistry()
+registry.register("parcels", PARCELS_PATH, load_parcels)
+registry.register("meteor", STORE_PATH, open_store, fingerprint=store_fingerprint)
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import tempfile
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+
+from tree_tracker.cache import evict
+from tree_tracker.tracing import span
+
+# Rendered PNGs, shared by every session, with their own size budget
+FIGURE_CACHE_DIR: str = os.getenv("FIGURE_CACHE_DIR", "data/cache/figures")
+FIGURE_CACHE_BYTES = int(os.getenv("FIGURE_CACHE_BYTES", 512 * 1024**2))
+
+# Figures are saved at 100 dpi, so a 10 inch axis shows about 1000 pixels, the
+# size of the decimated Planet reads (cog.DISPLAY_PIXELS)
+FIGURE_DPI = 100
+PREVIEW_PIXELS = 1000
+
+
+# Function to build the cache key of a figure
+def figure_key(name: str, *parts: Any) -> str:
+    """
+    Build the key of a rendered figure from everything it is drawn from
+
+    :param name: Figure name
+    :param parts: Inputs of the figure, e.g. file digests, metric and parcel
+    :return: Hex key, also covering the rendering resolution
+    """
+
+    parts = (name, *parts, FIGURE_DPI, PREVIEW_PIXELS)
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(FIGURE_CACHE_DIR, key[:2], f"{key}.png")
+
+
+# Function to load a cached figure
+def load_figure(key: str) -> bytes | None:
+    """
+    Load a rendered figure and mark it as recently used
+
+    :param key: Figure key
+    :return: PNG bytes, or None on a miss
+    """
+
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return png
+
+
+# Function to store a rendered figure
+def store_figure(key: str, png: bytes) -> None:
+    """
+    Store a rendered figure, then enforce the figure cache budget
+
+    :param key: Figure key
+    :param png: PNG bytes
+    """
+
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial PNG
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    evict(FIGURE_CACHE_BYTES, FIGURE_CACHE_DIR, suffix=".png")
+
+
+# Function to fetch a rendered figure, drawing it on a miss
+def cached_figure(key: str, render: Callable[[], Any]) -> bytes:
+    """
+    Return the PNG of a figure, rendering and storing it on a miss
+
+    :param key: Figure key from figure_key
+    :param render: Callable returning a matplotlib Figure, closed once saved
+    :return: PNG bytes
+    """
+
+    png = load_figure(key)
+    if png is not None:
+        return png
+
+    import io
+
+    import matplotlib.pyplot as plt
+
+    with span("render.figure"):
+        fig = render()
+        buffer = io.BytesIO()
+        try:
+            fig.savefig(buffer, format="png", dpi=FIGURE_DPI, bbox_inches="tight")
+        finally:
+            plt.close(fig)
+    png = buffer.getvalue()
+    store_figure(key, png)
+
+    return png
+
+
+# Function to downsample an image for display
+def downsample(image: np.ndarray, max_pixels: int = PREVIEW_PIXELS) -> np.ndarray:
+    """
+    Shrink an image so its longest side fits the display, with area averaging
+
+    :param image: Image or single-band array
+    :param max_pixels: Longest side of the preview
+    :return: Preview, the image itself if it already fits
+    """
+
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = max_pixels / max(height, width)
+    if scale >= 1:
+        return image
+
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
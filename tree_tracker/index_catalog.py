@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import pandas as pd
+import rasterio  # type: ignore
+
+from tree_tracker.indices import INDICES, read_indices
+from tree_tracker.tracing import span
+
+CATALOG_PATH: str = os.getenv("INDEX_CATALOG_PATH", "data/cache/index_stats.parquet")
+
+KEY_COLUMNS = ["path", "mtime", "size"]
+STAT_COLUMNS = [f"{name}_{stat}" for name in INDICES for stat in ("min", "max", "average")]
+
+# Serialises the read-modify-write of the catalog between dashboard sessions
+_catalog_lock = threading.Lock()
+
+
+def _fingerprint(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Function to compute the index statistics of one scene
+def scene_stats(path: str) -> dict[str, Any]:
+    """
+    Compute the whole-scene NDVI/NDWI/MSAVI2 statistics of a scene
+
+    :param path: Scene GeoTIFF
+    :return: Catalog row with the path, its mtime/size fingerprint and the statistics
+    """
+
+    mtime, size = _fingerprint(path)
+    with rasterio.open(path) as src:
+        _, stats = read_indices(src, INDICES, keep_arrays=False)
+
+    row: dict[str, Any] = {"path": path, "mtime": mtime, "size": size}
+    for name in INDICES:
+        row[f"{name}_min"] = stats[name]["min"]
+        row[f"{name}_max"] = stats[name]["max"]
+        row[f"{name}_average"] = stats[name]["mean"]
+
+    return row
+
+
+# Function to read the catalog from disk
+def read_catalog(catalog_path: str = CATALOG_PATH) -> pd.DataFrame:
+    """
+    Read the statistics catalog
+
+    :param catalog_path: Parquet catalog file
+    :return: Catalog, empty if it does not exist yet
+    """
+
+    if not os.path.isfile(catalog_path):
+        return pd.DataFrame(columns=KEY_COLUMNS + STAT_COLUMNS)
+
+    return pd.read_parquet(catalog_path)
+
+
+def _write_catalog(df: pd.DataFrame, catalog_path: str) -> None:
+    os.makedirs(os.path.dirname(catalog_path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(catalog_path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, catalog_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+# Function to bring the catalog up to date with a list of scenes
+@span("catalog.update")
+def update_catalog(
+    paths: list[str],
+    catalog_path: str = CATALOG_PATH,
+    workers: int | None = None,
+    rebuild: bool = False,
+) -> pd.DataFrame:
+    """
+    Update the statistics catalog incrementally
+
+    Rows whose path, mtime and size still match are reused, only new or changed
+    scenes are processed, in a process pool when there is more than one.
+
+    :param paths: Scenes that should be in the catalog
+    :param catalog_path: Parquet catalog file
+    :param workers: Number of worker processes, defaults to the CPU count
+    :param rebuild: Ignore the existing catalog and process every scene
+    :return: Catalog rows for the given paths
+    """
+
+    catalog = pd.DataFrame(columns=KEY_COLUMNS + STAT_COLUMNS)
+    if not rebuild:
+        catalog = read_catalog(catalog_path)
+
+    current = pd.DataFrame(
+        [(path, *_fingerprint(path)) for path in paths], columns=KEY_COLUMNS
+    ).astype({"mtime": "int64", "size": "int64"})
+    fresh = current.merge(catalog.astype({"mtime": "int64", "size": "int64"}), on=KEY_COLUMNS)
+    todo = sorted(set(paths) - set(fresh["path"]))
+
+    rows: list[dict[str, Any]] = []
+    if len(todo) == 1 or workers == 1:
+        rows = [scene_stats(path) for path in todo]
+    elif todo:
+        # Spawned workers, forking a multi-threaded Streamlit server is unsafe
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            rows = list(pool.map(scene_stats, todo))
+
+    result = pd.concat([fresh, pd.DataFrame(rows, columns=KEY_COLUMNS + STAT_COLUMNS)])
+    result = result.reset_index(drop=True)[KEY_COLUMNS + STAT_COLUMNS]
+
+    if rows or rebuild:
+        with _catalog_lock:
+            # Keep the rows of other scenes that still exist on disk, re-read in case
+            # another session updated the catalog while the scenes were processed
+            latest = catalog if rebuild else read_catalog(catalog_path)
+            others = latest[~latest["path"].isin(paths) & latest["path"].map(os.path.isfile)]
+            _write_catalog(pd.concat([others, result], ignore_index=True), catalog_path)
+
+    return result
@@ -0,0 +1,168 @@
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+import numpy as np
+from rasterio.windows import Window  # type: ignore
+
+from tree_tracker.cog import OVERVIEW_RESAMPLING
+from tree_tracker.tracing import span
+
+INDICES: list[str] = ["NDVI", "NDWI", "MSAVI2"]
+
+# Planet analytic band numbers (1-based) used by each index
+INDEX_BANDS: dict[str, tuple[int, ...]] = {
+    "NDVI": (3, 4),
+    "NDWI": (2, 4),
+    "MSAVI2": (3, 4),
+}
+
+# Pixels read per strip, bounds the working memory of a pass
+STRIP_PIXELS = 1 << 22
+
+
+class IndexStats:
+    """
+    Running min/max/mean of an index, ignoring NaN like np.nanmin/nanmax/nanmean
+    """
+
+    def __init__(self) -> None:
+        self.min = np.inf
+        self.max = -np.inf
+        self.total = 0.0
+        self.count = 0
+
+    def update(self, values: np.ndarray) -> None:
+        valid = values[~np.isnan(values)]
+        if valid.size:
+            self.min = min(self.min, float(valid.min()))
+            self.max = max(self.max, float(valid.max()))
+            self.total += float(valid.sum(dtype=np.float64))
+            self.count += valid.size
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else np.nan
+
+    def as_dict(self) -> dict[str, float]:
+        if not self.count:
+            return {"min": np.nan, "max": np.nan, "mean": np.nan}
+        return {"min": self.min, "max": self.max, "mean": self.mean}
+
+
+# Function to compute indices from band arrays
+@span("indices.compute")
+def compute_indices(bands: dict[int, np.ndarray], indices: Iterable[str]) -> dict[str, np.ndarray]:
+    """
+    Compute vegetation indices from already loaded float32 bands
+
+    :param bands: Mapping of band number to array
+    :param indices: Index names to compute
+    :return: Mapping of index name to float32 array
+    """
+
+    out: dict[str, np.ndarray] = {}
+    # Allow division by zero, it yields NaN/inf as before
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name in indices:
+            if name == "NDVI":
+                red, nir = bands[3], bands[4]
+                out[name] = (nir - red) / (nir + red)
+            elif name == "NDWI":
+                green, nir = bands[2], bands[4]
+                out[name] = (green - nir) / (green + nir)
+            elif name == "MSAVI2":
+                red, nir = bands[3], bands[4]
+                # 2∗ir+1 and 8(ir−r)
+                msavi2_first = 2 * nir + 1
+                msavi2_second = 8 * (nir - red)
+                out[name] = (msavi2_first - np.sqrt(np.square(msavi2_first) - msavi2_second)) / 2
+            else:
+                raise ValueError(f"Unknown index: {name}")
+
+    return out
+
+
+def _strips(window: Window, block_height: int) -> Iterator[Window]:
+    # Full-width strips, aligned on the raster block height
+    width, height = int(window.width), int(window.height)
+    rows = max(block_height, (STRIP_PIXELS // max(width, 1)) // block_height * block_height)
+    for row in range(0, height, rows):
+        yield Window(window.col_off, window.row_off + row, width, min(rows, height - row))
+
+
+# Function to compute several indices in one pass over a raster
+@span("indices.read")
+def read_indices(
+    src: Any,
+    indices: Iterable[str] = INDICES,
+    window: Window | None = None,
+    keep_arrays: bool = True,
+    out_shape: tuple[int, int] | None = None,
+) -> tuple[dict[str, np.ndarray], dict[str, dict[str, float]]]:
+    """
+    Read the needed bands once, strip by strip, and compute the requested indices
+
+    With keep_arrays=False only the statistics are accumulated, so scenes larger
+    than memory can be processed.
+
+    :param src: Open rasterio dataset
+    :param indices: Index names to compute
+    :param window: Raster window to read, defaults to the whole scene
+    :param keep_arrays: Return the full index arrays as well as the statistics
+    :param out_shape: Read the window decimated to (rows, cols), from overviews when present
+    :return: Mapping of index name to float32 array, and to its min/max/mean
+    """
+
+    indices = list(indices)
+    band_list = sorted({band for name in indices for band in INDEX_BANDS[name]})
+    if window is None:
+        window = Window(0, 0, src.width, src.height)
+
+    if out_shape is not None:
+        # Display reads are small, a single decimated read is enough
+        data = src.read(
+            band_list,
+            window=window,
+            out_shape=(len(band_list), *out_shape),
+            resampling=OVERVIEW_RESAMPLING,
+            out_dtype="float32",
+        )
+        arrays = compute_indices(dict(zip(band_list, data)), indices)
+        stats = {name: IndexStats() for name in indices}
+        for name, values in arrays.items():
+            stats[name].update(values)
+        return arrays if keep_arrays else {}, {name: acc.as_dict() for name, acc in stats.items()}
+
+    height, width = int(window.height), int(window.width)
+    arrays = (
+        {name: np.empty((height, width), np.float32) for name in indices} if keep_arrays else {}
+    )
+    stats = {name: IndexStats() for name in indices}
+
+    block_height = src.block_shapes[0][0] if src.block_shapes else 1
+    for strip in _strips(window, block_height):
+        data = src.read(band_list, window=strip, out_dtype="float32")
+        bands = dict(zip(band_list, data))
+        row = int(strip.row_off - window.row_off)
+
+        for name, values in compute_indices(bands, indices).items():
+            stats[name].update(values)
+            if keep_arrays:
+                arrays[name][row : row + values.shape[0]] = values
+
+    return arrays, {name: acc.as_dict() for name, acc in stats.items()}
+
+
+@span("indices.calculate_ndvi")
+def calculate_ndvi(src):
+    return read_indices(src, ["NDVI"])[0]["NDVI"]
+
+
+@span("indices.calculate_ndwi")
+def calculate_ndwi(src):
+    return read_indices(src, ["NDWI"])[0]["NDWI"]
+
+
+@span("indices.calculate_msavi2")
+def calculate_msavi2(src):
+    return read_indices(src, ["MSAVI2"])[0]["MSAVI2"]
@@ -0,0 +1,348 @@
+import os
+import threading
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import numpy as np
+
+from tree_tracker.tracing import span
+from tree_tracker.util import file_digest
+
+IMAGE_SIZE = 416
+TILE_OVERLAP = 64
+BATCH_SIZE = 8
+
+# Session threading, overridable per deployment
+INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", os.cpu_count() or 1))
+INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", 1))
+# onnxruntime.GraphOptimizationLevel member, onnxruntime itself is imported on first use
+GRAPH_OPTIMIZATION = "ORT_ENABLE_ALL"
+
+# Bound on the number of distinct input shapes buffered per session
+MAX_BOUND_SHAPES = 4
+
+
+class PooledSession:
+    """
+    InferenceSession wrapper that runs through IO binding with preallocated buffers
+
+    Exposes the subset of the InferenceSession interface used by the pipeline
+    (get_inputs, get_outputs, run), so it can be passed wherever a session is
+    expected. Buffers are allocated once per input shape and reused across runs.
+    """
+
+    def __init__(self, session: Any) -> None:
+        self.session = session
+        self._lock = threading.Lock()
+        self._bindings: dict[tuple, tuple[Any, dict[str, np.ndarray], dict[str, np.ndarray]]] = {}
+
+    def get_inputs(self) -> list[Any]:
+        return self.session.get_inputs()
+
+    def get_outputs(self) -> list[Any]:
+        return self.session.get_outputs()
+
+    def _bind(self, input_feed: dict[str, np.ndarray]) -> tuple[Any, dict, dict]:
+        import onnxruntime  # type: ignore
+
+        # Resolve symbolic dimensions (e.g. a dynamic batch) from the fed shapes
+        dims: dict[str, int] = {}
+        for node in self.session.get_inputs():
+            for dim, size in zip(node.shape, input_feed[node.name].shape):
+                if not isinstance(dim, int) and dim is not None:
+                    dims[dim] = size
+
+        binding = self.session.io_binding()
+        inputs: dict[str, np.ndarray] = {}
+        for name, array in input_feed.items():
+            inputs[name] = np.empty_like(array, order="C")
+            binding.bind_ortvalue_input(
+                name, onnxruntime.OrtValue.ortvalue_from_numpy(inputs[name])
+            )
+
+        outputs: dict[str, np.ndarray] = {}
+        for node in self.session.get_outputs():
+            shape = [dim if isinstance(dim, int) else dims.get(dim) for dim in node.shape]
+            if all(isinstance(dim, int) for dim in shape) and node.type == "tensor(float)":
+                outputs[node.name] = np.empty(shape, dtype=np.float32)
+                binding.bind_ortvalue_output(
+                    node.name, onnxruntime.OrtValue.ortvalue_from_numpy(outputs[node.name])
+                )
+            else:
+                # Shape only known after the run, let onnxruntime allocate it
+                binding.bind_output(node.name, "cpu")
+
+        return binding, inputs, outputs
+
+    @span("onnx.run")
+    def run(self, output_names: list[str] | None, input_feed: dict[str, np.ndarray]) -> list:
+        """
+        Run the model on the bound buffers
+
+        :param output_names: Names of the outputs to return, None for all
+        :param input_feed: Mapping of input name to array
+        :return: List of output arrays, owned by the caller
+        """
+
+        key = tuple((name, array.shape, array.dtype.str) for name, array in input_feed.items())
+        with self._lock:
+            if key not in self._bindings:
+                if len(self._bindings) >= MAX_BOUND_SHAPES:
+                    self._bindings.pop(next(iter(self._bindings)))
+                self._bindings[key] = self._bind(input_feed)
+            binding, inputs, outputs = self._bindings[key]
+
+            for name, array in input_feed.items():
+                np.copyto(inputs[name], array)
+            self.session.run_with_iobinding(binding)
+
+            names = [node.name for node in self.session.get_outputs()]
+            if len(outputs) == len(names):
+                results = [outputs[name].copy() for name in names]
+            else:
+                # Some outputs were left to onnxruntime, copy them all in binding order
+                results = binding.copy_outputs_to_cpu()
+
+        if output_names is None:
+            return results
+        return [results[names.index(name)] for name in output_names]
+
+
+_sessions: dict[tuple[str, str], PooledSession] = {}
+_sessions_lock = threading.Lock()
+
+
+# Function to build the tuned session options
+def session_options() -> Any:
+    """
+    Build the session options shared by every pooled session
+
+    :return: onnxruntime.SessionOptions with explicit threading and optimisation level
+    """
+
+    import onnxruntime  # type: ignore
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = INTRA_OP_THREADS
+    options.inter_op_num_threads = INTER_OP_THREADS
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = getattr(
+        onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION
+    )
+
+    return options
+
+
+# Function to fetch a model session from the process-wide pool
+@span("onnx.session")
+def get_session(model_path: str) -> PooledSession:
+    """
+    Get a cached inference session for a model file
+
+    Sessions are keyed by model path and content hash, so they are shared by
+    every dashboard session in the process and rebuilt only when the file changes.
+
+    :param model_path: Path to the .onnx model
+    :return: Pooled session for the model
+    """
+
+    import onnxruntime  # type: ignore
+
+    key = (os.path.abspath(model_path), file_digest(model_path))
+    with _sessions_lock:
+        pooled = _sessions.get(key)
+        if pooled is None:
+            # Drop sessions built from a previous version of the same file
+            for stale in [k for k in _sessions if k[0] == key[0]]:
+                del _sessions[stale]
+            session = onnxruntime.InferenceSession(
+                model_path, sess_options=session_options(), providers=["CPUExecutionProvider"]
+            )
+            pooled = _sessions[key] = PooledSession(session)
+
+    return pooled
+
+
+# Function to compute the tile origins along one axis
+def tile_origins(
+    length: int, tile_size: int = IMAGE_SIZE, overlap: int = TILE_OVERLAP
+) -> list[int]:
+    """
+    Compute the start offsets of overlapping tiles covering an axis
+
+    :param length: Axis length in pixels
+    :param tile_size: Tile size in pixels
+    :param overlap: Minimum overlap between neighbouring tiles in pixels
+    :return: Sorted tile start offsets, the last tile is flush with the axis end
+    """
+
+    if length <= tile_size:
+        return [0]
+
+    stride = max(tile_size - overlap, 1)
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+
+    return origins
+
+
+# Function to build the seam blending weights
+def blend_weights(tile_size: int = IMAGE_SIZE, overlap: int = TILE_OVERLAP) -> np.ndarray:
+    """
+    Build a 2D weight map that tapers linearly towards the tile borders
+
+    :param tile_size: Tile size in pixels
+    :param overlap: Overlap between neighbouring tiles in pixels
+    :return: Weight map of shape (tile_size, tile_size), strictly positive
+    """
+
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        taper = np.linspace(0.0, 1.0, overlap + 2, dtype=np.float32)[1:-1]
+        ramp[:overlap] = taper
+        ramp[-overlap:] = np.minimum(ramp[-overlap:], taper[::-1])
+
+    return np.outer(ramp, ramp)
+
+
+# Function to convert an RGB tile into the model input layout
+def preprocess_tile(tile: np.ndarray, tile_size: int = IMAGE_SIZE) -> np.ndarray:
+    """
+    Pad an RGB tile to the model size and convert it to a float32 CHW array
+
+    :param tile: RGB tile of shape (H, W, 3) with H, W <= tile_size
+    :param tile_size: Model input size in pixels
+    :return: Array of shape (3, tile_size, tile_size) scaled to [0, 1]
+    """
+
+    height, width = tile.shape[:2]
+    if height < tile_size or width < tile_size:
+        tile = np.pad(
+            tile, ((0, tile_size - height), (0, tile_size - width), (0, 0)), mode="reflect"
+        )
+
+    return np.transpose(tile, (2, 0, 1)).astype(np.float32) / 255.0
+
+
+def _session_batch_size(session: Any, batch_size: int) -> int:
+    # Models exported with a fixed batch dimension only accept that many tiles per run
+    dim = session.get_inputs()[0].shape[0]
+    return dim if isinstance(dim, int) and dim > 0 else batch_size
+
+
+def _run_batch(session: Any, batch: list[np.ndarray], batch_size: int) -> np.ndarray:
+    inputs = np.stack(batch)
+    count = len(batch)
+    if count < batch_size and session.get_inputs()[0].shape[0] == batch_size:
+        inputs = np.concatenate(
+            [inputs, np.zeros((batch_size - count, *inputs.shape[1:]), np.float32)]
+        )
+
+    outputs = session.run(None, {session.get_inputs()[0].name: inputs})
+    return np.asarray(outputs[0][:count, 0], dtype=np.float32)
+
+
+# Function to stream tiled predictions in horizontal bands
+def predict_tiled_stream(
+    session: Any,
+    read_window: Callable[[int, int, int, int], np.ndarray],
+    height: int,
+    width: int,
+    tile_size: int = IMAGE_SIZE,
+    overlap: int = TILE_OVERLAP,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Run tiled inference over an image and yield finished rows band by band
+
+    Only one row of tiles is held in memory at a time, so arbitrarily large
+    orthomosaics can be processed with a memory footprint of roughly
+    tile_size * width pixels.
+
+    :param session: ONNX runtime inference session
+    :param read_window: Callable (row, col, height, width) -> RGB uint8 window
+    :param height: Image height in pixels
+    :param width: Image width in pixels
+    :param tile_size: Model input size in pixels
+    :param overlap: Overlap between neighbouring tiles in pixels
+    :param batch_size: Number of tiles per session run
+    :return: Iterator of (row offset, probability band) pairs covering the image
+    """
+
+    batch_size = _session_batch_size(session, batch_size)
+    weights = blend_weights(tile_size, overlap)
+    row_origins = tile_origins(height, tile_size, overlap)
+    col_origins = tile_origins(width, tile_size, overlap)
+
+    # Accumulators for the rows that may still receive contributions
+    band_top = 0
+    acc = np.zeros((0, width), dtype=np.float32)
+    norm = np.zeros((0, width), dtype=np.float32)
+
+    for i, y in enumerate(row_origins):
+        tile_h = min(tile_size, height - y)
+        band_bottom = y + tile_h
+        if band_bottom - band_top > acc.shape[0]:
+            grow = band_bottom - band_top - acc.shape[0]
+            acc = np.concatenate([acc, np.zeros((grow, width), np.float32)])
+            norm = np.concatenate([norm, np.zeros((grow, width), np.float32)])
+
+        batch: list[np.ndarray] = []
+        placed: list[int] = []
+        for j, x in enumerate(col_origins):
+            tile_w = min(tile_size, width - x)
+            batch.append(preprocess_tile(read_window(y, x, tile_h, tile_w), tile_size))
+            placed.append(x)
+
+            if len(batch) == batch_size or j == len(col_origins) - 1:
+                preds = _run_batch(session, batch, batch_size)
+                for pred, px in zip(preds, placed):
+                    pw = min(tile_size, width - px)
+                    w = weights[:tile_h, :pw]
+                    acc[y - band_top : band_bottom - band_top, px : px + pw] += (
+                        pred[:tile_h, :pw] * w
+                    )
+                    norm[y - band_top : band_bottom - band_top, px : px + pw] += w
+                batch, placed = [], []
+
+        # Rows above the next tile row are final and can be released
+        next_top = row_origins[i + 1] if i + 1 < len(row_origins) else height
+        done = next_top - band_top
+        yield band_top, acc[:done] / norm[:done]
+
+        acc, norm = acc[done:], norm[done:]
+        band_top = next_top
+
+
+# Function to predict a full-resolution probability map
+@span("inference.predict_tiled")
+def predict_tiled(
+    session: Any,
+    image: np.ndarray,
+    tile_size: int = IMAGE_SIZE,
+    overlap: int = TILE_OVERLAP,
+    batch_size: int = BATCH_SIZE,
+) -> np.ndarray:
+    """
+    Run tiled inference over an in-memory RGB image
+
+    :param session: ONNX runtime inference session
+    :param image: RGB image of shape (H, W, 3)
+    :param tile_size: Model input size in pixels
+    :param overlap: Overlap between neighbouring tiles in pixels
+    :param batch_size: Number of tiles per session run
+    :return: Probability map of shape (H, W) at the native image resolution
+    """
+
+    height, width = image.shape[:2]
+    prob = np.empty((height, width), dtype=np.float32)
+
+    def read_window(row: int, col: int, h: int, w: int) -> np.ndarray:
+        return image[row : row + h, col : col + w]
+
+    for row, band in predict_tiled_stream(
+        session, read_window, height, width, tile_size, overlap, batch_size
+    ):
+        prob[row : row + band.shape[0]] = band
+
+    return prob
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+from tree_tracker.tracing import span
+
+# numpy, pandas and xarray are imported on first use, they dominate the import time
+if TYPE_CHECKING:
+    import pandas as pd
+    import xarray as xr
+
+# ERA5-Land inputs, one variable per file
+GRIB_FILES: dict[str, str] = {
+    "t2m": "data/meteor/ERA5_Land_2020_2022_t2m.grib",
+    "tp": "data/meteor/ERA5_Land_2020_2022_tp.grib",
+    "e": "data/meteor/ERA5_Land_2020_2022_te.grib",
+}
+METEOR_VARIABLES = list(GRIB_FILES)
+
+STORE_PATH: str = os.getenv("METEOR_STORE_PATH", "data/meteor/era5_land.zarr")
+DAILY_PATH: str = os.getenv("METEOR_DAILY_PATH", "data/meteor/era5_land_daily.parquet")
+
+# Daily aggregation of each variable, as shown on the meteorological page
+DAILY_AGGREGATES: dict[str, str] = {"t2m": "max", "tp": "sum", "e": "sum"}
+DAILY_COLUMNS = ["latitude", "longitude", "date"] + list(DAILY_AGGREGATES)
+
+# About one year of steps per chunk, 8x8 grid cells per chunk: a point's full history
+# is one chunk read per year and variable. The time chunk is derived from the time
+# step of the ingested data, TIME_CHUNK (hourly, as ERA5-Land) is the fallback
+TIME_CHUNK = 24 * 366
+SPACE_CHUNK = 8
+
+# Serialises the rebuild of a stale daily table between dashboard sessions
+_daily_lock = threading.Lock()
+
+
+def _flatten_time(ds: xr.Dataset) -> xr.Dataset:
+    # Flatten cfgrib's (time, step) forecast layout onto a single valid_time axis
+    import numpy as np
+    import pandas as pd
+
+    if "step" in ds.dims:
+        ds = ds.stack(hour=("time", "step")).reset_index("hour", drop=True)
+        ds = ds.swap_dims({"hour": "valid_time"})
+    elif "valid_time" in ds.coords and "time" in ds.dims:
+        ds = ds.swap_dims({"time": "valid_time"})
+
+    ds = ds.drop_vars([name for name in ds.coords if name not in ds.dims])
+    ds = ds.sortby("valid_time")
+    keep = ~pd.Index(ds["valid_time"].values).duplicated()
+
+    return ds.isel(valid_time=np.flatnonzero(keep))
+
+
+# Function to open an ERA5-Land GRIB file on a single time axis
+@span("meteor.grib_decode")
+def open_grib(path: str) -> xr.Dataset:
+    """
+    Open an ERA5-Land GRIB file with cfgrib, indexed by valid_time
+
+    :param path: GRIB file
+    :return: Dataset of variables over (latitude, longitude, valid_time)
+    """
+
+    import xarray as xr
+
+    return _flatten_time(xr.open_dataset(path, engine="cfgrib"))
+
+
+def _time_chunk(ds: xr.Dataset) -> int:
+    # Number of time steps in a year, from the most common step of the data
+    import numpy as np
+
+    times = ds["valid_time"].values
+    if times.size < 2:
+        return TIME_CHUNK
+    steps, counts = np.unique(np.diff(np.sort(times)), return_counts=True)
+    step = steps[counts.argmax()]
+    if step <= np.timedelta64(0, "s"):
+        return TIME_CHUNK
+    return max(1, int(np.timedelta64(366, "D") // step))
+
+
+def _encoding(ds: xr.Dataset) -> dict[str, dict]:
+    chunks = {"valid_time": _time_chunk(ds), "latitude": SPACE_CHUNK, "longitude": SPACE_CHUNK}
+    return {name: {"chunks": tuple(chunks[dim] for dim in ds[name].dims)} for name in ds.data_vars}
+
+
+# Function to convert GRIB files into the Zarr store
+@span("meteor.ingest")
+def ingest_grib(
+    paths: Iterable[str] | None = None, store: str = STORE_PATH, append: bool = False
+) -> int:
+    """
+    Convert ERA5-Land GRIB files into one multi-variable Zarr store
+
+    In append mode only the time steps later than the end of the store are
+    written, so new ERA5 months can be added without rewriting history.
+
+    :param paths: GRIB files, one per variable, defaults to GRIB_FILES
+    :param store: Zarr store path
+    :param append: Append to an existing store instead of overwriting it
+    :return: Number of time steps written
+    """
+
+    import numpy as np
+    import xarray as xr
+
+    paths = list(GRIB_FILES.values()) if paths is None else list(paths)
+    ds = xr.merge([open_grib(path) for path in paths], join="outer", compat="override")
+    ds = ds[[name for name in METEOR_VARIABLES if name in ds.data_vars]].astype(np.float32)
+
+    if append and os.path.exists(store):
+        with xr.open_zarr(store, chunks=None) as existing:
+            last = existing["valid_time"].values.max()
+        ds = ds.sel(valid_time=ds["valid_time"] > last)
+        if not ds.sizes["valid_time"]:
+            return 0
+        ds.to_zarr(store, append_dim="valid_time")
+    else:
+        ds.to_zarr(store, mode="w", encoding=_encoding(ds))
+
+    return ds.sizes["valid_time"]
+
+
+# Function to open the meteorological store
+def open_store(store: str = STORE_PATH) -> xr.Dataset:
+    """
+    Open the Zarr store lazily, building it from the GRIB files the first time
+
+    :param store: Zarr store path
+    :return: Lazily loaded dataset
+    """
+
+    import xarray as xr
+
+    if not os.path.exists(store):
+        ingest_grib(store=store)
+
+    return xr.open_zarr(store, chunks=None)
+
+
+# Function to extract the time series of one grid cell
+@span("meteor.point_series")
+def point_series(
+    ds: xr.Dataset, lat: float, lon: float, start: str | None = None, end: str | None = None
+) -> pd.DataFrame:
+    """
+    Read the full history of the grid cell nearest to a point
+
+    :param ds: Dataset from open_store
+    :param lat: Latitude (degrees)
+    :param lon: Longitude (degrees)
+    :param start: First valid time, None for the start of the store
+    :param end: Last valid time, None for the end of the store
+    :return: DataFrame indexed by valid_time with latitude, longitude and the variables
+    """
+
+    point = ds.sel(latitude=lat, longitude=lon, method="nearest")
+    point = point.sel(valid_time=slice(start, end)).load()
+
+    return point.to_dataframe()
+
+
+# Function to fingerprint the Zarr store
+def store_fingerprint(store: str = STORE_PATH) -> int:
+    """
+    Cheap fingerprint of the store, changes on every write and append
+
+    :param store: Zarr store path
+    :return: mtime (ns) of the consolidated metadata, 0 if the store does not exist
+    """
+
+    if not os.path.exists(store):
+        return 0
+
+    metadata = os.path.join(store, ".zmetadata")
+    return os.stat(metadata if os.path.exists(metadata) else store).st_mtime_ns
+
+
+def _daily_block(block: xr.Dataset) -> pd.DataFrame:
+    # Aggregate one block of grid cells to days, dropping cells without data
+    import xarray as xr
+
+    daily = xr.Dataset()
+    for name, how in DAILY_AGGREGATES.items():
+        if name in block.data_vars:
+            days = block[name].resample(valid_time="1D")
+            # min_count keeps days without any reading as NaN instead of 0
+            daily[name] = days.sum(min_count=1) if how == "sum" else getattr(days, how)()
+    df = daily.to_dataframe().reset_index().rename(columns={"valid_time": "date"})
+    df = df.dropna(how="all", subset=[name for name in DAILY_AGGREGATES if name in df])
+
+    return df.reindex(columns=DAILY_COLUMNS).sort_values(["latitude", "longitude", "date"])
+
+
+# Function to precompute the daily aggregates of every grid cell
+@span("meteor.build_daily")
+def build_daily(store: str = STORE_PATH, path: str = DAILY_PATH) -> int:
+    """
+    Aggregate the hourly store to one row per grid cell and day
+
+    The store is processed one chunk of grid cells at a time and every block is
+    written as its own Parquet row group, so a cell read touches one row group.
+
+    :param store: Zarr store path
+    :param path: Parquet file of daily aggregates
+    :return: Number of rows written
+    """
+
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    schema = pa.schema(
+        [("latitude", pa.float64()), ("longitude", pa.float64()), ("date", pa.timestamp("ns"))]
+        + [(name, pa.float32()) for name in DAILY_AGGREGATES]
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+
+    rows = 0
+    try:
+        ds = open_store(store)
+        try:
+            with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+                for i in range(0, ds.sizes["latitude"], SPACE_CHUNK):
+                    for j in range(0, ds.sizes["longitude"], SPACE_CHUNK):
+                        block = ds.isel(
+                            latitude=slice(i, i + SPACE_CHUNK),
+                            longitude=slice(j, j + SPACE_CHUNK),
+                        ).load()
+                        df = _daily_block(block)
+                        if len(df):
+                            writer.write_table(
+                                pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                            )
+                            rows += len(df)
+        finally:
+            ds.close()
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return rows
+
+
+# Function to read the daily aggregates of the grid cell nearest to a point
+@span("meteor.daily_series")
+def daily_series(
+    ds: xr.Dataset, lat: float, lon: float, path: str = DAILY_PATH, store: str = STORE_PATH
+) -> pd.DataFrame:
+    """
+    Read the daily aggregates of the grid cell nearest to a point
+
+    The table is rebuilt first if it is missing or older than the store.
+
+    :param ds: Dataset from open_store, used to snap the point to the grid
+    :param lat: Latitude (degrees)
+    :param lon: Longitude (degrees)
+    :param path: Parquet file of daily aggregates
+    :param store: Zarr store path the table is built from
+    :return: DataFrame indexed by date with latitude, longitude and the daily variables
+    """
+
+    import pandas as pd
+
+    def stale() -> bool:
+        return not os.path.exists(path) or os.stat(path).st_mtime_ns < store_fingerprint(store)
+
+    # Only one session rebuilds, the others wait and read the new table
+    if stale():
+        with _daily_lock:
+            if stale():
+                build_daily(store, path)
+
+    cell = ds[["latitude", "longitude"]].sel(latitude=lat, longitude=lon, method="nearest")
+    df = pd.read_parquet(
+        path,
+        filters=[
+            ("latitude", "==", float(cell["latitude"])),
+            ("longitude", "==", float(cell["longitude"])),
+        ],
+    )
+
+    return df.set_index("date").sort_index()
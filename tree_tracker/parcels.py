@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any
+
+from tree_tracker.tracing import span
+
+# geopandas, pandas and shapely are imported on first use
+if TYPE_CHECKING:
+    import geopandas as gpd  # type: ignore
+    import pandas as pd
+
+PARCELS_PATH: str = os.getenv("PARCELS_PATH", "data/parcel/BondyPlantedParcels.geojson")
+PARCELS_PARQUET_PATH: str = os.getenv("PARCELS_PARQUET_PATH", "data/cache/parcels.parquet")
+
+# WGS84 for the map bounds, Web Mercator for the boundary plots, Equidistant
+# Cylindrical for centroids
+PARCEL_CRS = [4326, 3857, 4087]
+
+
+# Function to build the dropdown labels of parcels
+def parcel_labels(parcels: pd.DataFrame) -> pd.Series:
+    """
+    Build "<index> | <name>" labels for parcels with vectorised string operations
+
+    The name is the plot name, else the parcel name, else the folder path
+    without its first (region) level.
+
+    :param parcels: Parcels with plotName, name and folders columns
+    :return: Labels aligned with the parcels' index
+    """
+
+    import pandas as pd
+
+    def _present(column: str) -> pd.Series:
+        values = parcels[column] if column in parcels else pd.Series(index=parcels.index)
+        values = values.astype("string")
+        return values.where(values.str.len() > 0)
+
+    folders = _present("folders").str.split("; ")
+    folder_name = folders.where(folders.str.len() <= 1, folders.str[1:]).str.join(", ")
+
+    name = _present("plotName").fillna(_present("name")).fillna(folder_name).fillna("")
+
+    return parcels.index.astype(str) + " | " + name
+
+
+class ParcelStore:
+    """
+    Parcels with cached reprojections, an STRtree over their geometries and dropdown labels
+
+    The store is shared between sessions and threads, its GeoDataFrames must not
+    be modified in place.
+    """
+
+    def __init__(self, parcels: gpd.GeoDataFrame) -> None:
+        from shapely import STRtree  # type: ignore
+
+        self.parcels = parcels.to_crs(4326)
+        self.labels = parcel_labels(self.parcels)
+        self.tree = STRtree(self.parcels.geometry.values)
+        self._projected: dict[Any, gpd.GeoDataFrame] = {
+            crs: self.parcels if crs == 4326 else self.parcels.to_crs(crs) for crs in PARCEL_CRS
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def regions(self) -> list[str]:
+        return list(self.parcels["regionName"].dropna().unique())
+
+    def to_crs(self, crs: Any) -> gpd.GeoDataFrame:
+        """
+        Get the parcels in a CRS, reprojected once per CRS
+
+        The PARCEL_CRS reprojections are computed up front.
+
+        :param crs: EPSG code or CRS
+        :return: Reprojected parcels
+        """
+
+        with self._lock:
+            projected = self._projected.get(crs)
+            if projected is None:
+                projected = self._projected[crs] = self.parcels.to_crs(crs)
+
+        return projected
+
+    def projections(self) -> list[gpd.GeoDataFrame]:
+        # Every cached reprojection, for memory reporting
+        with self._lock:
+            return list(self._projected.values())
+
+    def region_labels(self, region: str) -> list[str]:
+        """
+        Get the dropdown labels of the parcels of a region
+
+        :param region: Region name
+        :return: Labels, in file order
+        """
+
+        return self.labels[self.parcels["regionName"] == region].tolist()
+
+    def query(self, geometry: Any, predicate: str = "intersects") -> gpd.GeoDataFrame:
+        """
+        Find the parcels matching a geometry through the STRtree
+
+        :param geometry: Shapely geometry in EPSG:4326
+        :param predicate: Spatial predicate, as in STRtree.query
+        :return: Matching parcels, in file order
+        """
+
+        return self.parcels.iloc[sorted(self.tree.query(geometry, predicate=predicate))]
+
+
+# Function to convert the parcels GeoJSON to GeoParquet
+def convert_to_geoparquet(
+    path: str = PARCELS_PATH, parquet_path: str = PARCELS_PARQUET_PATH
+) -> bool:
+    """
+    Write the parcels as GeoParquet, unless the GeoParquet file is up to date
+
+    :param path: Parcels GeoJSON
+    :param parquet_path: GeoParquet file
+    :return: True if the file was written, else False
+    """
+
+    import geopandas as gpd  # type: ignore
+
+    if (
+        os.path.exists(parquet_path)
+        and os.stat(parquet_path).st_mtime_ns >= os.stat(path).st_mtime_ns
+    ):
+        return False
+
+    os.makedirs(os.path.dirname(parquet_path) or ".", exist_ok=True)
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    gpd.read_file(path).to_parquet(tmp_path, index=True)
+    os.replace(tmp_path, parquet_path)
+
+    return True
+
+
+# Function to load the parcel store
+@span("parcels.load")
+def load_parcels(path: str = PARCELS_PATH, parquet_path: str = PARCELS_PARQUET_PATH) -> ParcelStore:
+    """
+    Load the parcels from GeoParquet, converting the GeoJSON first if it changed
+
+    :param path: Parcels GeoJSON
+    :param parquet_path: GeoParquet file
+    :return: Parcel store
+    """
+
+    import geopandas as gpd  # type: ignore
+
+    convert_to_geoparquet(path, parquet_path)
+
+    return ParcelStore(gpd.read_parquet(parquet_path))
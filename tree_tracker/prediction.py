@@ -0,0 +1,276 @@
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+from tree_tracker.tracing import span
+
+# Reduced decodes, JPEGs are scaled in the DCT domain without decoding every pixel
+REDUCED_READ_FLAGS: dict[int, int] = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# Function to read a drone image as RGB
+@span("image.read")
+def read_image(path: str, reduce: int = 1) -> np.ndarray:
+    """
+    Read an image file into an RGB array
+
+    :param path: Image file
+    :param reduce: Downscaling factor applied while decoding, 1, 2, 4 or 8
+    :return: RGB uint8 array of shape (ceil(H / reduce), ceil(W / reduce), 3)
+    """
+
+    image = cv2.imread(path, REDUCED_READ_FLAGS[reduce])
+    if image is None:
+        raise ValueError(f"Could not read image: {path}")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+# Function to read the size of an image without decoding it
+def image_shape(path: str) -> tuple[int, int]:
+    """
+    Read the dimensions of an image from its header, as oriented by read_image
+
+    :param path: Image file
+    :return: (rows, cols)
+    """
+
+    from PIL import Image
+
+    with Image.open(path) as image:
+        width, height = image.size
+        # cv2.imread applies the EXIF orientation, 5 to 8 are rotated by 90 degrees
+        if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+
+    return height, width
+
+
+# Function to pick the decode reduction for a display size
+def reduction_factor(shape: tuple[int, ...], max_pixels: int) -> int:
+    """
+    Pick the largest decode reduction that keeps the image at least max_pixels wide
+
+    :param shape: Full-resolution shape (rows, cols, ...)
+    :param max_pixels: Pixels needed along the longest side
+    :return: 1, 2, 4 or 8
+    """
+
+    longest = max(shape[0], shape[1])
+    return max(
+        factor for factor in REDUCED_READ_FLAGS if factor == 1 or longest / factor >= max_pixels
+    )
+
+
+# Function to decode an encoded image buffer as RGB
+@span("image.decode")
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decode an encoded image (JPEG, PNG, ...) into an RGB array
+
+    :param data: Encoded image bytes
+    :return: RGB uint8 array of shape (H, W, 3)
+    """
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class Components(NamedTuple):
+    """
+    Connected components of a binary mask, one row per object
+    """
+
+    labels: np.ndarray  # (H, W) int32 label image, 0 is background
+    boxes: np.ndarray  # (N, 4) x1, y1, x2, y2 with exclusive x2, y2
+    areas: np.ndarray  # (N,) object areas in pixels
+    centroids: np.ndarray  # (N, 2) x, y centroids
+
+    @property
+    def count(self) -> int:
+        return len(self.areas)
+
+
+# Function to find the objects of a prediction mask
+@span("postprocess.components")
+def connected_components(mask: np.ndarray) -> Components:
+    """
+    Label the 8-connected objects of a mask and measure them in a single pass
+
+    :param mask: Prediction mask, non-zero pixels are foreground
+    :return: Label image with per-object boxes, areas and centroids
+    """
+
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        (mask > 0).astype(np.uint8), connectivity=8, ltype=cv2.CV_32S
+    )
+
+    # Row 0 is the background
+    x, y = stats[1:, cv2.CC_STAT_LEFT], stats[1:, cv2.CC_STAT_TOP]
+    w, h = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+    boxes = np.stack([x, y, x + w, y + h], axis=1)
+
+    return Components(labels, boxes, stats[1:, cv2.CC_STAT_AREA], centroids[1:])
+
+
+# Function to bring components to a smaller image
+def scale_components(components: Components, shape: tuple[int, int]) -> Components:
+    """
+    Resample the components of a full-resolution mask to a preview's shape
+
+    :param components: Components of the full-resolution mask
+    :param shape: Preview (rows, cols)
+    :return: Components in preview pixels, with the same objects
+    """
+
+    height, width = components.labels.shape
+    fy, fx = shape[0] / height, shape[1] / width
+
+    labels = cv2.resize(components.labels, shape[::-1], interpolation=cv2.INTER_NEAREST)
+    boxes = np.round(components.boxes * [fx, fy, fx, fy]).astype(components.boxes.dtype)
+
+    return Components(labels, boxes, components.areas * fx * fy, components.centroids * [fx, fy])
+
+
+def _rectangle_outlines(shape: tuple[int, int], boxes: np.ndarray, thickness: int) -> np.ndarray:
+    # Rasterise all outlines at once: +1 on the outer rectangle, -1 on the inner one,
+    # accumulated with a 2D prefix sum
+    height, width = shape
+    half = thickness // 2
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+
+    # Same footprint as cv2.rectangle drawn from (x1, y1) to (x2, y2)
+    for sign, lo, hi in ((1, -half, half + 1), (-1, half + 1, -half)):
+        x1 = np.clip(boxes[:, 0] + lo, 0, width)
+        y1 = np.clip(boxes[:, 1] + lo, 0, height)
+        x2 = np.clip(boxes[:, 2] + hi, 0, width)
+        y2 = np.clip(boxes[:, 3] + hi, 0, height)
+        keep = (x2 > x1) & (y2 > y1)
+        x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+        np.add.at(diff, (y1, x1), sign)
+        np.add.at(diff, (y1, x2), -sign)
+        np.add.at(diff, (y2, x1), -sign)
+        np.add.at(diff, (y2, x2), sign)
+
+    return diff.cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0
+
+
+def _ring_offsets(radius: float, half: float) -> tuple[np.ndarray, np.ndarray]:
+    # (dy, dx) offsets of the pixels between radius - half and radius + half from the
+    # centre, built row by row so memory follows the circumference, not the area
+    outer = (radius + half) ** 2
+    inner = max(radius - half, 0) ** 2
+    reach = int(np.floor(radius + half))
+    dy = np.arange(-reach, reach + 1)
+
+    # Largest |dx| inside the outer circle, smallest |dx| outside the inner one
+    rem_out = outer - dy**2
+    x_out = np.floor(np.sqrt(rem_out)).astype(int)
+    x_out[(x_out + 1) ** 2 <= rem_out] += 1
+    x_out[x_out**2 > rem_out] -= 1
+    rem_in = inner - dy**2
+    x_in = np.ceil(np.sqrt(np.maximum(rem_in, 0))).astype(int)
+    x_in[(x_in > 0) & ((x_in - 1) ** 2 >= rem_in)] -= 1
+    x_in[x_in**2 < rem_in] += 1
+
+    counts = np.maximum(x_out - x_in + 1, 0)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    dx = np.arange(counts.sum()) - starts + np.repeat(x_in, counts)
+    dy = np.repeat(dy, counts)
+    mirror = dx > 0
+
+    return np.concatenate([dy, dy[mirror]]), np.concatenate([dx, -dx[mirror]])
+
+
+def _circle_outlines(
+    shape: tuple[int, int], centers: np.ndarray, radii: np.ndarray, thickness: int
+) -> np.ndarray:
+    # Objects are grouped by radius, so each ring stencil is built once and
+    # stamped on every centre of that radius with fancy indexing
+    height, width = shape
+    half = thickness / 2
+    outline = np.zeros(shape, dtype=bool)
+
+    for radius in np.unique(radii):
+        dy, dx = _ring_offsets(radius, half)
+
+        cx, cy = centers[radii == radius].T
+        ys = (cy[:, None] + dy[None, :]).ravel()
+        xs = (cx[:, None] + dx[None, :]).ravel()
+        inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        outline[ys[inside], xs[inside]] = True
+
+    return outline
+
+
+@span("postprocess.bboxes")
+def extract_bboxes(image, mask, circle=False, components=None, thickness=10):
+    if components is None:
+        components = connected_components(mask)
+    bboxes = components.boxes
+
+    drawed_image = image.copy()
+    if not circle:
+        outline = _rectangle_outlines(mask.shape[:2], bboxes, thickness=thickness)
+    else:
+        x1, y1, x2, y2 = bboxes.T
+        centers = np.stack([(x1 + x2) // 2, (y1 + y2) // 2], axis=1)
+        radii = np.maximum(x2 - x1, y2 - y1) // 2
+        outline = _circle_outlines(mask.shape[:2], centers, radii, thickness=thickness)
+
+    drawed_image[outline] = (255, 0, 0)
+
+    return bboxes, drawed_image
+
+
+@span("postprocess.overlay")
+def overlay_mask(image, mask, color=(255, 0, 0), alpha=0.4, components=None, thickness=10):
+    if components is None:
+        components = connected_components(mask)
+    fill = components.labels > 0
+
+    # Object boundaries thickened to a contour line, 10 px by default
+    boundary = fill & ~cv2.erode(fill.astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (thickness + 1, thickness + 1))
+    contour = cv2.dilate(boundary.astype(np.uint8), kernel).astype(bool)
+
+    drawed_image = image.copy()
+    drawed_image[contour] = color
+    canvas = np.ones_like(image, np.uint8)
+    canvas[fill] = color
+
+    drawed_image = cv2.addWeighted(canvas, alpha, drawed_image, 1 - alpha, 0)
+
+    return components.count, drawed_image
+
+
+# Function to estimate vegetation cover and tree count from a mask
+@span("postprocess.metrics")
+def mask_metrics(
+    pred_mask: np.ndarray, gsd: float, tree_size_in_meters: float
+) -> tuple[float, int]:
+    """
+    Estimate the vegetation percentage and the number of trees in a mask
+
+    :param pred_mask: Binary prediction mask
+    :param gsd: Ground Sampling Distance (m)
+    :param tree_size_in_meters: Tree size (m)
+    :return: Vegetation fraction and estimated number of trees
+    """
+
+    veg_pixels = np.count_nonzero(pred_mask > 0.0)
+    veg_percent = veg_pixels / np.prod(pred_mask.shape)
+
+    tree_size_in_pixels = tree_size_in_meters / gsd
+    num_tree = veg_pixels // tree_size_in_pixels
+
+    return float(veg_percent), int(num_tree)
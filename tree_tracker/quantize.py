@@ -0,0 +1,404 @@
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+import numpy as np
+
+from tree_tracker.inference import IMAGE_SIZE, TILE_OVERLAP, preprocess_tile, tile_origins
+from tree_tracker.tracing import span
+from tree_tracker.util import file_digest
+
+# Variants written next to the model as <stem>.<variant>.onnx. INT8 "dynamic" quantises
+# the weights only, "static" also the activations from calibration ranges, FP16 halves
+# the weights and keeps float32 inputs and outputs
+VARIANTS = ("int8-dynamic", "int8-static", "fp16")
+REFERENCE = "float32"
+
+# Benchmark report written next to the model, read by the Model Prediction page
+REPORT_SUFFIX = ".variants.json"
+
+# Drone images used to calibrate the static variant, and a disjoint set of them to
+# measure every variant on
+CALIBRATION_DIR: str = os.getenv("CALIBRATION_DIR", "data/drone")
+CALIBRATION_IMAGES = int(os.getenv("CALIBRATION_IMAGES", 4))
+EVALUATION_IMAGES = int(os.getenv("EVALUATION_IMAGES", 4))
+CALIBRATION_TILES = int(os.getenv("CALIBRATION_TILES", 64))
+
+
+# Function to get the path of a model variant
+def variant_path(model_path: str, variant: str) -> str:
+    """
+    Build the path of a quantised variant of a model
+
+    :param model_path: Original .onnx model
+    :param variant: One of VARIANTS
+    :return: <stem>.<variant>.onnx next to the model
+    """
+
+    return f"{os.path.splitext(model_path)[0]}.{variant}.onnx"
+
+
+# Function to get the path of a model's benchmark report
+def report_path(model_path: str) -> str:
+    """
+    Build the path of the variant benchmark report of a model
+
+    :param model_path: Original .onnx model
+    :return: <stem>.variants.json next to the model
+    """
+
+    return f"{os.path.splitext(model_path)[0]}{REPORT_SUFFIX}"
+
+
+# Function to sample calibration tiles from drone images
+def calibration_tiles(
+    image_paths: list[str], count: int = CALIBRATION_TILES, tile_size: int = IMAGE_SIZE
+) -> np.ndarray:
+    """
+    Sample model input tiles evenly from the tiling grid of the images
+
+    :param image_paths: Drone images
+    :param count: Number of tiles, spread over the images
+    :param tile_size: Model input size in pixels
+    :return: float32 array of shape (count, 3, tile_size, tile_size)
+    """
+
+    from tree_tracker.prediction import read_image
+
+    per_image = max(1, -(-count // len(image_paths)))
+    tiles = []
+    for path in image_paths:
+        image = read_image(path)
+        height, width = image.shape[:2]
+        grid = [
+            (y, x)
+            for y in tile_origins(height, tile_size, TILE_OVERLAP)
+            for x in tile_origins(width, tile_size, TILE_OVERLAP)
+        ]
+        picks = np.linspace(0, len(grid) - 1, min(per_image, len(grid))).round().astype(int)
+        for y, x in (grid[i] for i in picks):
+            tiles.append(preprocess_tile(image[y : y + tile_size, x : x + tile_size], tile_size))
+
+    return np.stack(tiles[:count])
+
+
+def _input_spec(model_path: str) -> tuple[str, int]:
+    # Input name and batch size of a model, 1 when the batch dimension is dynamic
+    import onnx  # type: ignore
+
+    node = onnx.load(model_path, load_external_data=False).graph.input[0]
+    batch = node.type.tensor_type.shape.dim[0].dim_value
+    return node.name, batch or 1
+
+
+# Function to build a quantised or half-precision variant of a model
+@span("quantize.build")
+def build_variant(model_path: str, variant: str, tiles: np.ndarray | None = None) -> str:
+    """
+    Write a variant of an ONNX model with onnxruntime's quantisation tools
+
+    Requires the onnx package.
+
+    :param model_path: Original float32 .onnx model
+    :param variant: One of VARIANTS
+    :param tiles: Calibration tiles from calibration_tiles, needed by "int8-static"
+    :return: Path of the variant
+    """
+
+    import onnx  # type: ignore
+
+    output = variant_path(model_path, variant)
+
+    if variant == "fp16":
+        from onnxruntime.transformers.float16 import convert_float_to_float16  # type: ignore
+
+        onnx.save(convert_float_to_float16(onnx.load(model_path), keep_io_types=True), output)
+        return output
+
+    from onnxruntime.quantization import (  # type: ignore
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process  # type: ignore
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Fold constants and infer shapes first, as recommended before quantisation
+        prepared = os.path.join(tmp_dir, "prepared.onnx")
+        quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+
+        if variant == "int8-dynamic":
+            quantize_dynamic(prepared, output, weight_type=QuantType.QInt8)
+        elif variant == "int8-static":
+            if tiles is None:
+                raise ValueError("int8-static needs calibration tiles")
+            name, batch = _input_spec(model_path)
+
+            class TileReader(CalibrationDataReader):
+                def __init__(self) -> None:
+                    usable = len(tiles) - len(tiles) % batch
+                    self.batches = iter(
+                        {name: tiles[i : i + batch]} for i in range(0, usable, batch)
+                    )
+
+                def get_next(self) -> dict[str, np.ndarray] | None:
+                    return next(self.batches, None)
+
+            quantize_static(
+                prepared,
+                output,
+                TileReader(),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+            )
+        else:
+            raise ValueError(f"Unknown variant {variant}, expected one of {VARIANTS}")
+
+    return output
+
+
+def _rss() -> int:
+    # Current resident set size of this process in bytes, the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _RssSampler:
+    # Highest RSS seen by a background thread polling every few milliseconds
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.peak = _rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self) -> "_RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+
+def _measure(model_path: str, image_paths: list[str], confidence: float) -> dict[str, Any]:
+    # Run in a fresh worker process, so the memory of one model does not hide another's.
+    # Memory is the peak RSS above the decoded images, sampled around the load and runs
+    from tree_tracker.inference import get_session, predict_tiled
+    from tree_tracker.prediction import read_image
+
+    images = [read_image(path) for path in image_paths]
+    baseline = _rss()
+
+    with _RssSampler() as sampler:
+        start = time.perf_counter()
+        session = get_session(model_path)
+        predict_tiled(session, images[0][:IMAGE_SIZE, :IMAGE_SIZE])
+        load_seconds = time.perf_counter() - start
+
+        seconds, masks = [], []
+        for image in images:
+            start = time.perf_counter()
+            prob = predict_tiled(session, image)
+            seconds.append(time.perf_counter() - start)
+            masks.append((np.packbits(prob > confidence), prob.shape))
+            del prob
+
+    return {
+        "load_seconds": load_seconds,
+        "seconds": float(np.mean(seconds)),
+        "peak_rss_mb": (sampler.peak - baseline) / 2**20,
+        "masks": masks,
+    }
+
+
+def _unpack(packed: tuple[np.ndarray, tuple[int, int]]) -> np.ndarray:
+    # Boolean mask back from the bits sent by a worker
+    bits, shape = packed
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+
+# Function to benchmark model variants against the original
+@span("quantize.benchmark")
+def benchmark_variants(
+    model_path: str,
+    variants: list[str],
+    image_paths: list[str],
+    confidence: float = 0.8,
+    gsd: float = 0.0013,
+    tree_size_in_meters: float = 4.0,
+) -> dict[str, dict[str, Any]]:
+    """
+    Measure the latency, memory and mask agreement of model variants
+
+    Every model runs in its own worker process over the same images. Masks are
+    compared with the original model's at the confidence threshold.
+
+    :param model_path: Original float32 .onnx model
+    :param variants: Variants to measure, built beforehand with build_variant
+    :param image_paths: Drone images
+    :param confidence: Confidence threshold of the masks
+    :param gsd: Ground Sampling Distance (m), for the tree count
+    :param tree_size_in_meters: Tree size (m), for the tree count
+    :return: Mapping of variant (REFERENCE for the original) to its measures
+    """
+
+    from tree_tracker.prediction import connected_components, mask_metrics
+
+    results: dict[str, dict[str, Any]] = {}
+    reference_masks: list[np.ndarray] = []
+    reference_trees = 0
+
+    for variant in [REFERENCE, *variants]:
+        path = model_path if variant == REFERENCE else variant_path(model_path, variant)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                measured = pool.submit(_measure, path, image_paths, confidence).result()
+        except Exception as e:
+            if variant == REFERENCE:
+                raise
+            # e.g. an operator without a kernel for the variant's precision
+            results[variant] = {"file": os.path.basename(path), "error": str(e)}
+            continue
+
+        masks = [_unpack(packed) for packed in measured.pop("masks")]
+        trees = sum(mask_metrics(mask, gsd, tree_size_in_meters)[1] for mask in masks)
+        patches = sum(connected_components(mask).count for mask in masks)
+        if variant == REFERENCE:
+            reference_masks, reference_trees = masks, trees
+
+        intersection = sum(np.count_nonzero(a & b) for a, b in zip(masks, reference_masks))
+        union = sum(np.count_nonzero(a | b) for a, b in zip(masks, reference_masks))
+        reference = results.get(REFERENCE, measured)
+
+        results[variant] = {
+            "file": os.path.basename(path),
+            "size_mb": os.path.getsize(path) / 2**20,
+            **measured,
+            "speedup": reference["seconds"] / measured["seconds"],
+            "mask_iou": intersection / union if union else 1.0,
+            "trees": trees,
+            "tree_drift": (trees - reference_trees) / reference_trees if reference_trees else 0.0,
+            "patches": patches,
+        }
+
+    return results
+
+
+# Function to split drone images into calibration and evaluation sets
+def split_images(
+    image_paths: list[str],
+    calibration: int = CALIBRATION_IMAGES,
+    evaluation: int = EVALUATION_IMAGES,
+) -> tuple[list[str], list[str]]:
+    """
+    Split images into disjoint calibration and evaluation sets, alternating so
+    both sample the whole collection
+
+    :param image_paths: Sorted drone images
+    :param calibration: Maximum number of calibration images
+    :param evaluation: Maximum number of evaluation images
+    :return: Calibration images, evaluation images
+    """
+
+    return image_paths[0::2][:calibration], image_paths[1::2][:evaluation]
+
+
+# Function to build and benchmark the variants of a model
+def optimise_model(
+    model_path: str,
+    calibration_paths: list[str],
+    evaluation_paths: list[str],
+    variants: list[str] | tuple[str, ...] = VARIANTS,
+    confidence: float = 0.8,
+) -> dict[str, Any]:
+    """
+    Build quantised variants of a model, benchmark them and write the report
+
+    A variant that fails to build or to run is recorded in the report with its error.
+
+    :param model_path: Original float32 .onnx model
+    :param calibration_paths: Drone images calibrating the static variant
+    :param evaluation_paths: Other drone images, the variants are measured on
+    :param variants: Variants to build, a subset of VARIANTS
+    :param confidence: Confidence threshold of the compared masks
+    :return: Report, also written to report_path(model_path)
+    """
+
+    if set(calibration_paths) & set(evaluation_paths):
+        raise ValueError("Calibration and evaluation images must be disjoint")
+
+    built: list[str] = []
+    failed: dict[str, dict[str, Any]] = {}
+    for variant in variants:
+        try:
+            tiles = calibration_tiles(calibration_paths) if variant == "int8-static" else None
+            build_variant(model_path, variant, tiles)
+        except Exception as e:
+            # e.g. static calibration failing, the other variants are still measured
+            path = variant_path(model_path, variant)
+            failed[variant] = {"file": os.path.basename(path), "error": str(e)}
+        else:
+            built.append(variant)
+
+    measured = benchmark_variants(model_path, built, evaluation_paths, confidence)
+    report = {
+        "model": os.path.basename(model_path),
+        "digest": file_digest(model_path),
+        "calibration_images": [os.path.basename(path) for path in calibration_paths],
+        "evaluation_images": [os.path.basename(path) for path in evaluation_paths],
+        "confidence": confidence,
+        "variants": {
+            variant: measured.get(variant) or failed[variant] for variant in [REFERENCE, *variants]
+        },
+    }
+
+    tmp_path = f"{report_path(model_path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path(model_path))
+
+    return report
+
+
+# Function to label model files with their measured speedups
+def variant_labels(reports: list[dict[str, Any]]) -> dict[str, str]:
+    """
+    Build dropdown labels for the benchmarked variants
+
+    :param reports: Reports written by optimise_model
+    :return: Mapping of variant file name to label, e.g. "m.int8-static.onnx (2.1x, IoU 0.97)"
+    """
+
+    labels = {}
+    for report in reports:
+        for variant, result in report["variants"].items():
+            if variant == REFERENCE or "error" in result:
+                continue
+            labels[
+                result["file"]
+            ] = f"{result['file']} ({result['speedup']:.1f}x, IoU {result['mask_iou']:.2f})"
+
+    return labels
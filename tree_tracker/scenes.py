@@ -0,0 +1,143 @@
+import glob
+import os
+import re
+from typing import Any
+
+import geopandas as gpd  # type: ignore
+import pandas as pd
+import rasterio  # type: ignore
+from rasterio.warp import transform_bounds  # type: ignore
+from shapely.geometry import box  # type: ignore
+
+# Acquisition date in Planet basemap names, e.g. ..._analytic_2022-06_clip.tif
+DATE_PATTERN = re.compile(r"(\d{4})-(\d{2})(?:-(\d{2}))?")
+
+SCENE_COLUMNS = ["path", "region", "date", "crs", "bounds", "count", "width", "height"]
+
+
+class SceneCatalog:
+    """
+    Planet scenes with their metadata and a spatial index over their footprints
+
+    Footprints are kept in EPSG:4326 in a GeoDataFrame, whose R-tree (sindex)
+    answers coverage queries.
+    """
+
+    def __init__(self, scenes: gpd.GeoDataFrame) -> None:
+        self.scenes = scenes.sort_values(["region", "date"]).reset_index(drop=True)
+
+    @property
+    def regions(self) -> list[str]:
+        return sorted(self.scenes["region"].unique())
+
+    def query(
+        self,
+        geometry: Any = None,
+        start: Any = None,
+        end: Any = None,
+        region: str | None = None,
+    ) -> gpd.GeoDataFrame:
+        """
+        Find the scenes covering a geometry within a date range
+
+        :param geometry: Shapely geometry in EPSG:4326, None for any footprint
+        :param start: First acquisition date (inclusive), None for no bound
+        :param end: Last acquisition date (inclusive), None for no bound
+        :param region: Restrict to one region
+        :return: Matching scenes sorted by region and date
+        """
+
+        scenes = self.scenes
+        if geometry is not None:
+            hits = scenes.sindex.query(geometry, predicate="intersects")
+            scenes = scenes.iloc[sorted(hits)]
+        if start is not None:
+            scenes = scenes[scenes["date"] >= pd.Timestamp(start)]
+        if end is not None:
+            scenes = scenes[scenes["date"] <= pd.Timestamp(end)]
+        if region is not None:
+            scenes = scenes[scenes["region"] == region]
+
+        return scenes
+
+    def scene(self, region: str, label: str) -> str | None:
+        """
+        Find the scene of a region for a YYYY-MM label
+
+        :param region: Region name
+        :param label: Month label, as in the index statistics
+        :return: Scene path, or None if there is none
+        """
+
+        scenes = self.scenes[
+            (self.scenes["region"] == region) & (self.scenes["date"].dt.strftime("%Y-%m") == label)
+        ]
+        return scenes["path"].iloc[0] if len(scenes) else None
+
+
+# Function to fingerprint the Planet directory tree
+def scan_fingerprint(data_path: str = "data/planet") -> tuple:
+    """
+    Cheap fingerprint of data/planet, changes when a region or scene is added, removed
+    or rewritten in place (e.g. converted to a COG)
+
+    :param data_path: Planet data directory
+    :return: Tuple of (path, mtime, size) triples of the directories and their files
+    """
+
+    if not os.path.isdir(data_path):
+        return ()
+
+    dirs = [data_path] + sorted(e.path for e in os.scandir(data_path) if e.is_dir())
+    fingerprint = []
+    for path in dirs:
+        fingerprint.append((path, os.stat(path).st_mtime_ns, 0))
+        if path == data_path:
+            continue
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_file():
+                stat = entry.stat()
+                fingerprint.append((entry.path, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(fingerprint)
+
+
+# Function to scan the Planet scenes
+def scan_scenes(data_path: str = "data/planet", pattern: str = "*_clip.tif") -> SceneCatalog:
+    """
+    Scan data/planet/<region>/ once and record every scene's metadata
+
+    :param data_path: Planet data directory, one sub-directory per region
+    :param pattern: Scene file name pattern
+    :return: Scene catalog, scenes without a date in their name are skipped
+    """
+
+    rows = []
+    for path in sorted(glob.glob(os.path.join(data_path, "*", pattern))):
+        match = DATE_PATTERN.search(os.path.basename(path))
+        if match is None:
+            continue
+        year, month, day = match.groups()
+
+        with rasterio.open(path) as src:
+            footprint = box(*transform_bounds(src.crs, "EPSG:4326", *src.bounds))
+            rows.append(
+                {
+                    "path": path,
+                    "region": os.path.basename(os.path.dirname(path)),
+                    "date": pd.Timestamp(int(year), int(month), int(day or 1)),
+                    "crs": src.crs.to_string(),
+                    "bounds": tuple(src.bounds),
+                    "count": src.count,
+                    "width": src.width,
+                    "height": src.height,
+                    "geometry": footprint,
+                }
+            )
+
+    scenes = gpd.GeoDataFrame(
+        rows, columns=SCENE_COLUMNS + ["geometry"], geometry="geometry", crs="EPSG:4326"
+    )
+    scenes["date"] = pd.to_datetime(scenes["date"])
+
+    return SceneCatalog(scenes)
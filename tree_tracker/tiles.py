@@ -0,0 +1,544 @@
+import functools
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from typing import Any
+
+import numpy as np
+
+from tree_tracker.cache import evict
+from tree_tracker.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# On-disk tile cache, shared by every session, with its own size budget
+TILE_CACHE_DIR: str = os.getenv("TILE_CACHE_DIR", "data/cache/tiles")
+TILE_CACHE_BYTES = int(os.getenv("TILE_CACHE_BYTES", 1024**3))
+
+# Address of the local tile server, reached by browsers through the /tiles/ location
+# of the nginx proxy (.platform/nginx) on the dashboard's own origin. Without the
+# proxy, e.g. in development, set TILE_URL to http://localhost:<port>
+TILE_HOST: str = os.getenv("TILE_HOST", "127.0.0.1")
+TILE_PORT = int(os.getenv("TILE_PORT", 8765))
+TILE_URL: str = os.getenv("TILE_URL", "/tiles")
+
+PLANET_DIR = "data/planet"
+DRONE_DIR = "data/drone"
+
+TILE_SIZE = 256
+# Half the width of the Web Mercator world (metres)
+MERCATOR_ORIGIN = 20037508.342789244
+
+# Fixed colour scale of each index, so that neighbouring tiles and zoom levels match
+INDEX_RANGES: dict[str, tuple[float, float]] = {
+    "NDVI": (-0.2, 1.0),
+    "NDWI": (-1.0, 0.4),
+    "MSAVI2": (-0.2, 1.0),
+}
+INDEX_COLORMAP = "viridis"
+
+# Prediction overlay colour and opacity, as overlay_mask on the prediction page
+MASK_COLOR = (0, 255, 0)
+MASK_ALPHA = 0.4
+
+# Tiles written between two passes of the cache eviction
+EVICT_EVERY = 256
+
+_SEGMENT = r"[^/]+"
+_ROUTES = {
+    "planet": re.compile(
+        rf"^/planet/({_SEGMENT})/({_SEGMENT})/([A-Z0-9]+)/(\d+)/(\d+)/(\d+)\.png$"
+    ),
+    "drone": re.compile(r"^/drone/(.+)/(\d+)/(\d+)/(\d+)\.png$"),
+    "prediction": re.compile(r"^/prediction/([0-9a-f]{64})/([0-9.]+)/(\d+)/(\d+)/(\d+)\.png$"),
+}
+
+_writes = 0
+_writes_lock = threading.Lock()
+_server: Any = None
+
+
+# Function to get the Web Mercator bounds of an XYZ tile
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """
+    Compute the EPSG:3857 bounds of a tile of the XYZ (slippy map) grid
+
+    :param z: Zoom level
+    :param x: Column, from the west
+    :param y: Row, from the north
+    :return: (left, bottom, right, top)
+    """
+
+    size = 2 * MERCATOR_ORIGIN / 2**z
+    left = -MERCATOR_ORIGIN + x * size
+    top = MERCATOR_ORIGIN - y * size
+
+    return left, top - size, left + size, top
+
+
+# Function to get the zoom level at which an image is shown at full resolution
+def pixel_max_zoom(shape: tuple[int, ...]) -> int:
+    """
+    Zoom level of a non-georeferenced image tiled from one tile at zoom 0
+
+    :param shape: Image shape (rows, cols, ...)
+    :return: Zoom level at which one tile pixel is one image pixel
+    """
+
+    return max(0, math.ceil(math.log2(max(shape[0], shape[1]) / TILE_SIZE)))
+
+
+@functools.lru_cache(maxsize=4)
+def _colormap(name: str) -> np.ndarray:
+    # 256-entry RGBA lookup table of a matplotlib colormap
+    import matplotlib
+
+    return (matplotlib.colormaps[name](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+
+# Function to colour an index array
+def colorize(
+    values: np.ndarray, vmin: float, vmax: float, cmap: str = INDEX_COLORMAP
+) -> np.ndarray:
+    """
+    Map values to RGBA colours on a fixed scale, NaN becomes transparent
+
+    :param values: Float array
+    :param vmin: Value shown with the first colour
+    :param vmax: Value shown with the last colour
+    :param cmap: Matplotlib colormap name
+    :return: RGBA uint8 array
+    """
+
+    valid = np.isfinite(values)
+    scaled = np.clip((np.where(valid, values, vmin) - vmin) / (vmax - vmin), 0, 1)
+    rgba = _colormap(cmap)[(scaled * 255).astype(np.uint8)]
+    rgba[~valid, 3] = 0
+
+    return rgba
+
+
+# Function to encode a tile
+def encode_png(rgba: np.ndarray) -> bytes:
+    """
+    Encode an RGBA array as PNG
+
+    :param rgba: RGBA uint8 array
+    :return: PNG bytes
+    """
+
+    import cv2
+
+    ok, png = cv2.imencode(".png", cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA))
+    if not ok:
+        raise ValueError("Could not encode tile")
+
+    return png.tobytes()
+
+
+@functools.lru_cache(maxsize=1)
+def _empty_png() -> bytes:
+    # Fully transparent tile, served outside the data
+    return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8))
+
+
+@functools.lru_cache(maxsize=64)
+def _scene_info(path: str, mtime_ns: int) -> tuple[tuple[float, ...], float, list[int]]:
+    # Web Mercator bounds, approximate Web Mercator resolution and overview factors of a scene
+    import rasterio  # type: ignore
+    from rasterio.warp import transform_bounds  # type: ignore
+
+    with rasterio.open(path) as src:
+        bounds = transform_bounds(src.crs, "EPSG:3857", *src.bounds)
+        return bounds, (bounds[2] - bounds[0]) / src.width, src.overviews(1)
+
+
+# Function to render a vegetation index tile of a Planet scene
+@span("tiles.index")
+def render_index_tile(path: str, metric: str, z: int, x: int, y: int) -> np.ndarray | None:
+    """
+    Render a Web Mercator tile of an index, read from the coarsest sufficient overview
+
+    :param path: Planet scene
+    :param metric: Index name, e.g. NDVI
+    :param z: Zoom level
+    :param x: Tile column
+    :param y: Tile row
+    :return: RGBA tile, None if the tile does not overlap the scene
+    """
+
+    import rasterio  # type: ignore
+    from rasterio.enums import Resampling  # type: ignore
+    from rasterio.transform import from_bounds  # type: ignore
+    from rasterio.vrt import WarpedVRT  # type: ignore
+
+    from tree_tracker.indices import INDEX_BANDS, compute_indices
+
+    bounds = tile_bounds(z, x, y)
+    scene_bounds, scene_res, factors = _scene_info(path, os.stat(path).st_mtime_ns)
+    if (
+        bounds[0] >= scene_bounds[2]
+        or bounds[2] <= scene_bounds[0]
+        or bounds[1] >= scene_bounds[3]
+        or bounds[3] <= scene_bounds[1]
+    ):
+        return None
+
+    # Coarsest overview that still has at least one pixel per tile pixel
+    decimation = (bounds[2] - bounds[0]) / TILE_SIZE / scene_res
+    levels = [level for level, factor in enumerate(factors) if factor <= decimation]
+    options = {"overview_level": levels[-1]} if levels else {}
+
+    bands = sorted(set(INDEX_BANDS[metric]))
+    with rasterio.open(path, **options) as src, WarpedVRT(
+        src,
+        crs="EPSG:3857",
+        transform=from_bounds(*bounds, TILE_SIZE, TILE_SIZE),
+        width=TILE_SIZE,
+        height=TILE_SIZE,
+        resampling=Resampling.bilinear,
+    ) as vrt:
+        data = vrt.read(bands, out_dtype="float32")
+        valid = vrt.dataset_mask() > 0
+
+    values = compute_indices(dict(zip(bands, data)), [metric])[metric]
+    values[~valid] = np.nan
+
+    return colorize(values, *INDEX_RANGES[metric])
+
+
+def _pixel_crop(
+    array: np.ndarray, z: int, x: int, y: int, max_zoom: int | None = None, reduce: int = 1
+) -> tuple[np.ndarray, int] | None:
+    # Part of an image covered by a tile of its pixel grid, and the shrink factor. A
+    # reduced decode is cropped in its own pixels, max_zoom is then the full image's
+    if max_zoom is None:
+        max_zoom = pixel_max_zoom(array.shape)
+    if z > max_zoom:
+        return None
+    scale = 2 ** (max_zoom - z) // reduce
+    row, col = y * TILE_SIZE * scale, x * TILE_SIZE * scale
+    crop = array[row : row + TILE_SIZE * scale, col : col + TILE_SIZE * scale]
+    if crop.size == 0:
+        return None
+
+    return crop, scale
+
+
+def _pixel_tile(crop: np.ndarray, scale: int, channels: int = 4) -> np.ndarray:
+    # Shrink a crop to tile pixels and place it on a transparent tile
+    import cv2
+
+    if scale > 1:
+        size = (math.ceil(crop.shape[1] / scale), math.ceil(crop.shape[0] / scale))
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+
+    tile = np.zeros((TILE_SIZE, TILE_SIZE, channels), crop.dtype)
+    tile[: crop.shape[0], : crop.shape[1], : crop.shape[2] if crop.ndim == 3 else 1] = (
+        crop if crop.ndim == 3 else crop[..., None]
+    )
+    return tile
+
+
+@functools.lru_cache(maxsize=4)
+def _drone_image(path: str, mtime_ns: int, reduce: int = 1) -> np.ndarray:
+    # Decoded drone image, kept for the following tile requests
+    from tree_tracker.prediction import read_image
+
+    return read_image(path, reduce=reduce)
+
+
+@functools.lru_cache(maxsize=2)
+def _loaded_probability(key: str) -> np.ndarray:
+    # Cached probability map, kept for the following tile requests. A miss raises,
+    # lru_cache does not memoize exceptions, so the map is picked up once it is cached
+    from tree_tracker.cache import load_prediction
+
+    prob = load_prediction(key)
+    if prob is None:
+        raise LookupError(key)
+    return prob
+
+
+def _probability(key: str) -> np.ndarray | None:
+    # Probability map of a prediction key, None until the model has run
+    try:
+        return _loaded_probability(key)
+    except LookupError:
+        return None
+
+
+# Function to render a tile of a drone image
+@span("tiles.drone")
+def render_drone_tile(path: str, z: int, x: int, y: int) -> np.ndarray | None:
+    """
+    Render a tile of a drone image on its pixel grid
+
+    :param path: Drone image
+    :param z: Zoom level, pixel_max_zoom is full resolution
+    :param x: Tile column
+    :param y: Tile row
+    :return: RGBA tile, None outside the image
+    """
+
+    from tree_tracker.prediction import REDUCED_READ_FLAGS, image_shape
+
+    # Zoomed-out tiles are cut from a reduced decode (up to 1/8), only the deepest
+    # levels decode the full image
+    max_zoom = pixel_max_zoom(image_shape(path))
+    reduce = max(f for f in REDUCED_READ_FLAGS if f <= 2 ** max(0, max_zoom - z))
+    image = _drone_image(path, os.stat(path).st_mtime_ns, reduce)
+    cropped = _pixel_crop(image, z, x, y, max_zoom=max_zoom, reduce=reduce)
+    if cropped is None:
+        return None
+
+    crop, scale = cropped
+    tile = _pixel_tile(crop, scale)
+    # Opaque over the image, transparent past its edges
+    tile[: math.ceil(crop.shape[0] / scale), : math.ceil(crop.shape[1] / scale), 3] = 255
+    return tile
+
+
+# Function to render a tile of a prediction mask
+@span("tiles.prediction")
+def render_prediction_tile(
+    key: str, confidence: float, z: int, x: int, y: int
+) -> np.ndarray | None:
+    """
+    Render a tile of a thresholded probability map on the image's pixel grid
+
+    :param key: Prediction cache key of the probability map
+    :param confidence: Confidence threshold
+    :param z: Zoom level, pixel_max_zoom is full resolution
+    :param x: Tile column
+    :param y: Tile row
+    :return: RGBA tile, None outside the image or if the map is not cached
+    """
+
+    prob = _probability(key)
+    if prob is None:
+        return None
+
+    cropped = _pixel_crop(prob, z, x, y)
+    if cropped is None:
+        return None
+
+    # Mask coverage per tile pixel, boosted so small objects stay visible when zoomed out
+    crop, scale = cropped
+    coverage = _pixel_tile((crop > confidence).astype(np.float32), scale, channels=1)[..., 0]
+    coverage = np.clip(coverage * 4, 0, 1)
+
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)
+    rgba[..., :3] = MASK_COLOR
+    rgba[..., 3] = (coverage * MASK_ALPHA * 255).astype(np.uint8)
+    return rgba
+
+
+def _source(tile_path: str) -> tuple[str, Any] | None:
+    # Resolve a tile URL path to the identity of its source and a render callable
+    match = _ROUTES["planet"].match(tile_path)
+    if match:
+        region, scene, metric, z, x, y = match.groups()
+        path = os.path.join(PLANET_DIR, region, f"{scene}.tif")
+        if metric not in INDEX_RANGES or ".." in (region + scene) or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        identity = (
+            f"planet|{path}|{stat.st_mtime_ns}|{stat.st_size}|{metric}|{INDEX_RANGES[metric]}"
+        )
+        return identity, lambda: render_index_tile(path, metric, int(z), int(x), int(y))
+
+    match = _ROUTES["drone"].match(tile_path)
+    if match:
+        name, z, x, y = match.groups()
+        path = os.path.join(DRONE_DIR, name)
+        if ".." in name or os.path.isabs(name) or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        identity = f"drone|{path}|{stat.st_mtime_ns}|{stat.st_size}"
+        return identity, lambda: render_drone_tile(path, int(z), int(x), int(y))
+
+    match = _ROUTES["prediction"].match(tile_path)
+    if match:
+        key, confidence, z, x, y = match.groups()
+        identity = f"prediction|{key}|{float(confidence)}"
+        return identity, lambda: render_prediction_tile(
+            key, float(confidence), int(z), int(x), int(y)
+        )
+
+    return None
+
+
+# Function to fetch a tile through the tile cache
+def get_tile(tile_path: str) -> bytes | None:
+    """
+    Return the PNG of a tile, rendering and caching it on a miss
+
+    :param tile_path: URL path, /planet/<region>/<scene>/<metric>/<z>/<x>/<y>.png,
+        /drone/<image>/<z>/<x>/<y>.png or /prediction/<key>/<confidence>/<z>/<x>/<y>.png
+    :return: PNG bytes, None for an unknown layer or source
+    """
+
+    global _writes
+    source = _source(tile_path)
+    if source is None:
+        return None
+    identity, render = source
+
+    z, x, y = tile_path[: -len(".png")].rsplit("/", 3)[1:]
+    digest = hashlib.sha256(identity.encode()).hexdigest()[:16]
+    path = os.path.join(TILE_CACHE_DIR, digest, z, x, f"{y}.png")
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        # Mark the tile as recently used, the budget evicts the least recently used ones
+        os.utime(path)
+        return png
+    except FileNotFoundError:
+        pass
+
+    rgba = render()
+    if rgba is None:
+        # Empty tiles are cheap to tell apart, they are not cached
+        return _empty_png()
+
+    png = encode_png(rgba)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+
+    with _writes_lock:
+        _writes += 1
+        due = _writes % EVICT_EVERY == 0
+    if due:
+        evict(TILE_CACHE_BYTES, TILE_CACHE_DIR, suffix=".png")
+
+    return png
+
+
+# Function to start the local tile server
+def serve_tiles(port: int = TILE_PORT, block: bool = False) -> str:
+    """
+    Serve tiles over HTTP, from a daemon thread started once per process
+
+    :param port: HTTP port
+    :param block: Serve from the calling thread instead, e.g. from the CLI
+    :return: Base URL of the tile server as seen by browsers, TILE_URL
+    """
+
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import unquote
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            try:
+                png = get_tile(unquote(self.path.split("?")[0]))
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            if png is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(png)))
+            self.send_header("Cache-Control", "max-age=3600")
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    if block:
+        ThreadingHTTPServer((TILE_HOST, port), Handler).serve_forever()
+        return TILE_URL
+
+    with _writes_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((TILE_HOST, port), Handler)
+            except OSError as e:
+                # Another dashboard process (or `tree_tracker tiles`) holds the port, it
+                # serves the same tiles from the shared cache
+                logger.warning("Tile server not started on port %s: %s", port, e)
+                _server = False
+            else:
+                threading.Thread(target=_server.serve_forever, name="tiles", daemon=True).start()
+
+    return TILE_URL
+
+
+# Function to build an embeddable Leaflet map
+def leaflet_html(
+    layers: dict[str, str],
+    bounds: tuple[float, float, float, float],
+    max_zoom: int = 20,
+    pixel_grid: bool = False,
+    geojson: str | None = None,
+    height: int = 600,
+) -> str:
+    """
+    Build a self-contained Leaflet page showing tile layers
+
+    :param layers: Mapping of layer name to XYZ URL template, the first one is shown
+    :param bounds: (west, south, east, north) in degrees, or (0, 0, width, height) in
+        pixels on the pixel grid
+    :param max_zoom: Deepest zoom level, pixel_max_zoom on the pixel grid
+    :param pixel_grid: Tiles of a non-georeferenced image instead of Web Mercator tiles
+    :param geojson: GeoJSON outlines drawn over the tiles
+    :param height: Map height in pixels
+    :return: HTML document
+    """
+
+    config = {
+        "layers": layers,
+        "bounds": bounds,
+        "maxZoom": max_zoom,
+        "pixelGrid": pixel_grid,
+        "geojson": json.loads(geojson) if geojson else None,
+    }
+
+    return f"""
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<div id="map" style="height: {height}px;"></div>
+<script>
+const config = {json.dumps(config)};
+const map = L.map("map", {{crs: config.pixelGrid ? L.CRS.Simple : L.CRS.EPSG3857}});
+let bounds;
+if (config.pixelGrid) {{
+    const [, , width, height] = config.bounds;
+    bounds = L.latLngBounds(
+        map.unproject([0, height], config.maxZoom), map.unproject([width, 0], config.maxZoom)
+    );
+}} else {{
+    const [west, south, east, north] = config.bounds;
+    bounds = L.latLngBounds([south, west], [north, east]);
+    L.tileLayer("https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png", {{
+        maxZoom: config.maxZoom, attribution: "&copy; OpenStreetMap contributors"
+    }}).addTo(map);
+}}
+const overlays = {{}};
+Object.entries(config.layers).forEach(([name, url], i) => {{
+    overlays[name] = L.tileLayer(url, {{
+        maxZoom: config.maxZoom, maxNativeZoom: config.maxZoom, bounds: bounds
+    }});
+    if (i === 0 || config.pixelGrid) overlays[name].addTo(map);
+}});
+if (config.geojson) {{
+    overlays["Parcels"] = L.geoJSON(config.geojson, {{
+        style: {{color: "red", weight: 1, fill: false}}
+    }}).addTo(map);
+}}
+L.control.layers(null, overlays, {{collapsed: false}}).addTo(map);
+map.fitBounds(bounds);
+</script>
+"""
@@ -0,0 +1,382 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text file, rewritten at the end of every traced rerun ("" to disable),
+# and optional HTTP port serving the same metrics (0 to disable)
+METRICS_PATH: str = os.getenv("TRACE_METRICS_PATH", "data/metrics/tree_tracker.prom")
+METRICS_PORT = int(os.getenv("TRACE_METRICS_PORT", 0))
+
+# Profiles captured on request, with cProfile or pyinstrument when it is installed.
+# Dashboard visitors can only ask for one (?profile=1) when TRACE_PROFILE_PAGES is set,
+# and only the PROFILE_MAX_FILES most recent profiles are kept
+PROFILE_DIR: str = os.getenv("TRACE_PROFILE_DIR", "data/profiles")
+PROFILER: str = os.getenv("TRACE_PROFILER", "cprofile")
+PROFILE_PAGES = os.getenv("TRACE_PROFILE_PAGES", "").lower() in ("1", "true")
+PROFILE_MAX_FILES = int(os.getenv("TRACE_PROFILE_MAX_FILES", 20))
+
+# Level of the per-trace JSON lines, logged to stderr unless the application
+# configures the tree_tracker.tracing logger itself
+LOG_LEVEL: str = os.getenv("TRACE_LOG_LEVEL", "INFO")
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Cumulative duration histogram of one span name, in the Prometheus layout
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.errors += error
+
+
+class Trace:
+    """
+    Spans recorded during one page rerun or command, aggregated by span name
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.id = os.urandom(6).hex()
+        self.start = time.perf_counter()
+        self.spans: dict[str, dict[str, Any]] = {}
+        self.profiler: Any = None
+
+    def record(self, name: str, seconds: float) -> None:
+        stats = self.spans.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+_histograms: dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+_local = threading.local()
+_server: Any = None
+
+
+# Function to time a block or a function
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time the enclosed block, usable as a context manager or a decorator
+
+    The duration is added to the span's histogram and to the trace of the
+    current thread, if any.
+
+    :param name: Span name, dotted by component, e.g. "s3.sync"
+    """
+
+    error = False
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        with _histograms_lock:
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram()
+            histogram.observe(seconds, error)
+
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace.record(name, seconds)
+        else:
+            logger.debug(json.dumps({"span": name, "seconds": round(seconds, 6), "error": error}))
+
+
+def _configure_logger() -> None:
+    # Send the trace records to stderr, once, if nobody configured the logger
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def _start_profiler() -> Any:
+    # pyinstrument if asked for and installed, else cProfile
+    if PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler  # type: ignore
+
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, profiling with cProfile")
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active per process on Python 3.12+
+        logger.warning("Another profile is being captured, skipping this one")
+        return None
+    return profiler
+
+
+def _save_profile(profiler: Any, trace: Trace) -> str:
+    # Stop the profiler, write its profile next to the others and return the path
+    pyinstrument = hasattr(profiler, "output_html")
+    if pyinstrument:
+        profiler.stop()
+    else:
+        profiler.disable()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", trace.name).strip("_").lower()
+    stem = os.path.join(PROFILE_DIR, f"{slug}-{time.strftime('%Y%m%d-%H%M%S')}-{trace.id}")
+
+    if pyinstrument:
+        path = f"{stem}.html"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+        _rotate_profiles()
+        return path
+
+    import io
+    import pstats
+
+    path = f"{stem}.prof"
+    profiler.dump_stats(path)
+    _rotate_profiles()
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+    logger.info("Profile of %s -> %s\n%s", trace.name, path, summary.getvalue())
+    return path
+
+
+def _rotate_profiles() -> None:
+    # Keep the PROFILE_MAX_FILES most recent profiles
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            entries.append((os.stat(path).st_mtime_ns, path))
+        except FileNotFoundError:
+            continue
+    for _, path in sorted(entries, reverse=True)[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Function to check whether the current dashboard request asks for a profile
+def profile_requested() -> bool:
+    """
+    Check the page URL for ?profile=1, honoured only when TRACE_PROFILE_PAGES is set
+
+    :return: True if the current Streamlit rerun should be profiled
+    """
+
+    if not PROFILE_PAGES:
+        return False
+
+    import streamlit as st
+
+    if hasattr(st, "query_params"):
+        value = st.query_params.get("profile")
+    else:
+        value = (st.experimental_get_query_params().get("profile") or [None])[0]
+
+    return value in ("1", "true")
+
+
+# Function to start the trace of a page rerun or command
+def start_trace(name: str, profile: bool = False) -> Trace:
+    """
+    Start collecting the spans of the current thread
+
+    An unfinished trace left on the thread (e.g. by st.stop) is finished first.
+
+    :param name: Page or command name
+    :param profile: Also capture a cProfile/pyinstrument profile until finish_trace
+    :return: Trace
+    """
+
+    if getattr(_local, "trace", None) is not None:
+        finish_trace()
+
+    _configure_logger()
+    serve_metrics()
+    trace = _local.trace = Trace(name)
+    if profile:
+        trace.profiler = _start_profiler()
+
+    return trace
+
+
+# Function to finish the trace of the current thread
+def finish_trace() -> dict[str, Any] | None:
+    """
+    Log the spans of the current trace as one JSON line and export the metrics
+
+    :return: Logged record, None if no trace was started
+    """
+
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return None
+    _local.trace = None
+
+    record: dict[str, Any] = {
+        "trace": trace.name,
+        "id": trace.id,
+        "seconds": round(time.perf_counter() - trace.start, 6),
+        "spans": {
+            name: {key: round(value, 6) for key, value in stats.items()}
+            for name, stats in sorted(trace.spans.items(), key=lambda item: -item[1]["seconds"])
+        },
+    }
+    if trace.profiler is not None:
+        record["profile"] = _save_profile(trace.profiler, trace)
+    logger.info(json.dumps(record))
+
+    if METRICS_PATH:
+        write_metrics(METRICS_PATH)
+
+    return record
+
+
+# Function to trace a block as one request
+@contextlib.contextmanager
+def trace(name: str, profile: bool = False) -> Iterator[Trace]:
+    """
+    Context manager form of start_trace/finish_trace
+
+    :param name: Page or command name
+    :param profile: Also capture a profile of the block
+    """
+
+    current = start_trace(name, profile=profile)
+    try:
+        yield current
+    finally:
+        finish_trace()
+
+
+# Function to render the span histograms
+def prometheus_text() -> str:
+    """
+    Render the span histograms in the Prometheus text exposition format
+
+    :return: Metrics text
+    """
+
+    with _histograms_lock:
+        histograms = {
+            name: (h.buckets, list(h.counts), h.count, h.sum, h.errors)
+            for name, h in sorted(_histograms.items())
+        }
+
+    lines = [
+        "# HELP tree_tracker_span_seconds Duration of traced spans",
+        "# TYPE tree_tracker_span_seconds histogram",
+    ]
+    for name, (buckets, counts, count, total, _) in histograms.items():
+        for bound, bucket_count in zip(buckets, counts):
+            lines.append(
+                f'tree_tracker_span_seconds_bucket{{span="{name}",le="{bound}"}} {bucket_count}'
+            )
+        lines.append(f'tree_tracker_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+        lines.append(f'tree_tracker_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f'tree_tracker_span_seconds_count{{span="{name}"}} {count}')
+
+    lines += [
+        "# HELP tree_tracker_span_errors_total Traced spans that raised",
+        "# TYPE tree_tracker_span_errors_total counter",
+    ]
+    for name, (*_, errors) in histograms.items():
+        lines.append(f'tree_tracker_span_errors_total{{span="{name}"}} {errors}')
+
+    return "\n".join(lines) + "\n"
+
+
+# Function to write the metrics for a Prometheus textfile collector
+def write_metrics(path: str = METRICS_PATH) -> None:
+    """
+    Write the span histograms atomically, as expected by a textfile collector
+
+    :param path: .prom file
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Every session thread writes at the end of its rerun, give each its own temporary file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+# Function to serve the metrics over HTTP
+def serve_metrics(port: int = METRICS_PORT) -> None:
+    """
+    Serve the metrics at http://<host>:<port>/metrics from a daemon thread, once per process
+
+    :param port: HTTP port, 0 disables the endpoint
+    """
+
+    global _server
+    if not port or _server is not None:
+        return
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    with _histograms_lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
@@ -1,9 +1,21 @@
+import functools
+import hashlib
+import io
+import json
 import os
-from typing import Any, Literal
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Hashable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import TYPE_CHECKING, Any, Literal, NamedTuple
 
-import boto3  # type: ignore
 from dotenv import find_dotenv, load_dotenv
-from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from tree_tracker.tracing import span
+
+if TYPE_CHECKING:
+    from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 # Load environment variables
 load_dotenv(find_dotenv())
@@ -14,9 +26,83 @@ SECRET_KEY: str | None = os.getenv("AWS_SECRET_ACCESS_KEY")
 BUCKET_NAME = "tree-tracker-store"
 DATA_TYPE: list[str] = ["drone", "meteor", "model", "parcel", "planet"]
 
+DATA_DIR = "data"
+MANIFEST_PATH: str = os.getenv("S3_MANIFEST_PATH", "data/.s3_manifest.json")
+
+# Parallel downloads per sync, and parallel parts per large object
+SYNC_WORKERS = int(os.getenv("S3_SYNC_WORKERS", 8))
+TRANSFER_OPTIONS: dict[str, int] = {
+    "multipart_threshold": 32 * 2**20,
+    "multipart_chunksize": 16 * 2**20,
+    "max_concurrency": 4,
+}
+
+# Byte budget of the objects fetched into data/, least recently used ones are evicted
+DATA_CACHE_BYTES = int(os.getenv("DATA_CACHE_BYTES", 5 * 2**30))
+# Access times are recorded at this resolution (seconds), so reruns of a page
+# fetching the same objects do not rewrite the manifest every time
+ACCESS_RESOLUTION = 60
+# Pins expire when they are not renewed for this long (seconds), so the pins of
+# dashboard sessions that went away do not keep their objects forever
+PIN_SECONDS = int(os.getenv("DATA_PIN_SECONDS", 3600))
+
+# Uploads come from memory, drone images are split in 8 MB parts sent in parallel
+UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", 4))
+UPLOAD_OPTIONS: dict[str, int] = {
+    "multipart_threshold": 8 * 2**20,
+    "multipart_chunksize": 8 * 2**20,
+    "max_concurrency": 4,
+}
+
+# Serialises manifest updates between the dashboard sessions of a process
+_manifest_lock = threading.Lock()
+# Keys exempt from eviction and the time they were pinned, one per owner and group,
+# e.g. the model of every dashboard session
+_pinned: dict[tuple[Hashable, str], tuple[str, float]] = {}
+
+
+# boto3 is imported and the S3 resource built on first use, not at import
+@functools.lru_cache(maxsize=None)
+def _s3() -> Any:
+    import boto3  # type: ignore
+    from botocore.config import Config  # type: ignore
+
+    return boto3.resource(
+        "s3",
+        aws_access_key_id=ACCESS_KEY,
+        aws_secret_access_key=SECRET_KEY,
+        # Enough pooled connections for every worker's ranged part requests
+        config=Config(max_pool_connections=SYNC_WORKERS * TRANSFER_OPTIONS["max_concurrency"]),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _transfer_config(upload: bool = False) -> Any:
+    from boto3.s3.transfer import TransferConfig  # type: ignore
+
+    return TransferConfig(**(UPLOAD_OPTIONS if upload else TRANSFER_OPTIONS))
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to hash a local file
+def file_digest(path: str) -> str:
+    """
+    Compute the SHA-256 of a file, memoised on its path, mtime and size
+
+    :param path: File to hash
+    :return: Hex digest of the file content
+    """
 
-_s3: Any = boto3.resource("s3", aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY)  # type: ignore
-_s3_bucket: Any = _s3.Bucket(BUCKET_NAME)
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
 
 
 # Function to upload data to S3
@@ -37,44 +123,491 @@ def upload_data(file_obj: str, data_type: str, object_name: str | None = None) -
 
     # Upload the file
     try:
-        _s3_bucket.upload_file(file_obj, object_name)
+        _s3().Bucket(BUCKET_NAME).upload_file(file_obj, object_name)
     except Exception:
         # print(e)
         return False
     return True
 
 
+class SyncStats(NamedTuple):
+    """
+    Outcome of one S3 sync
+    """
+
+    downloaded: int
+    skipped: int
+    failed: list[str]
+    bytes: int
+    seconds: float
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 2**20 / self.seconds if self.seconds > 0 else 0.0
+
+
+# Function to read the local S3 manifest
+def read_manifest(manifest_path: str = MANIFEST_PATH) -> dict[str, dict[str, Any]]:
+    """
+    Read the manifest of objects downloaded by previous syncs
+
+    :param manifest_path: Manifest JSON file
+    :return: Mapping of object key to its ETag, size and the local file mtime
+    """
+
+    if not os.path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest: dict[str, dict[str, Any]], manifest_path: str) -> None:
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _local_matches(entry: dict[str, Any] | None, local_path: str) -> bool:
+    # The local copy is still the file recorded in the manifest
+    if entry is None:
+        return False
+    try:
+        stat = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+
+def _is_current(entry: dict[str, Any] | None, obj: dict[str, Any], local_path: str) -> bool:
+    # Same remote ETag and size as the last download, and the local copy untouched since
+    if entry is None or entry["etag"] != obj["ETag"] or entry["size"] != obj["Size"]:
+        return False
+    return _local_matches(entry, local_path)
+
+
+def _download(client: Any, bucket: str, key: str, local_path: str) -> int:
+    # Download next to the target, then swap, so readers never see a partial file
+    # The temporary name is unique, concurrent fetches of one key never share it
+    os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(local_path) or ".", suffix=".part")
+    os.close(fd)
+    try:
+        client.download_file(bucket, key, tmp_path, Config=_transfer_config())
+        os.replace(tmp_path, local_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.stat(local_path).st_mtime_ns
+
+
+# Function to sync an S3 prefix to the local data directory
+@span("s3.sync")
+def sync_data(
+    prefix: str,
+    data_dir: str = DATA_DIR,
+    bucket: str = BUCKET_NAME,
+    workers: int = SYNC_WORKERS,
+    manifest_path: str = MANIFEST_PATH,
+    client: Any = None,
+) -> SyncStats:
+    """
+    Download the objects under a prefix that are new or changed since the last sync
+
+    Objects are compared by ETag and size against the local manifest, and are
+    fetched in a thread pool, large ones as parallel ranged parts.
+
+    :param prefix: Key prefix, e.g. a DATA_TYPE
+    :param data_dir: Local directory mirroring the bucket
+    :param bucket: Bucket to sync from
+    :param workers: Number of parallel downloads
+    :param manifest_path: Manifest JSON file
+    :param client: S3 client, defaults to the shared pooled client
+    :return: Sync statistics
+    """
+
+    client = client or _s3().meta.client
+    start = time.perf_counter()
+
+    objects = [
+        obj
+        for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get("Contents", [])
+        if not obj["Key"].endswith("/")
+    ]
+
+    manifest = read_manifest(manifest_path)
+    todo = [
+        obj
+        for obj in objects
+        if not _is_current(manifest.get(obj["Key"]), obj, os.path.join(data_dir, obj["Key"]))
+    ]
+
+    updates: dict[str, dict[str, Any]] = {}
+    failed: list[str] = []
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    _download, client, bucket, obj["Key"], os.path.join(data_dir, obj["Key"])
+                ): obj
+                for obj in todo
+            }
+            for future in as_completed(futures):
+                obj = futures[future]
+                try:
+                    mtime_ns = future.result()
+                except Exception:
+                    failed.append(obj["Key"])
+                    continue
+                updates[obj["Key"]] = {
+                    "etag": obj["ETag"],
+                    "size": obj["Size"],
+                    "mtime_ns": mtime_ns,
+                    "accessed": time.time(),
+                }
+
+    # Forget objects removed from the bucket, their local copies are kept
+    remote = {obj["Key"] for obj in objects}
+    with _manifest_lock:
+        manifest = read_manifest(manifest_path)
+        stale = [key for key in manifest if key.startswith(prefix) and key not in remote]
+        for key in stale:
+            del manifest[key]
+        if updates or stale:
+            _write_manifest({**manifest, **updates}, manifest_path)
+
+    return SyncStats(
+        downloaded=len(updates),
+        skipped=len(objects) - len(todo),
+        failed=sorted(failed),
+        bytes=sum(entry["size"] for entry in updates.values()),
+        seconds=time.perf_counter() - start,
+    )
+
+
+# Function to pin an object in the local data cache
+def pin(key: str, group: str = "model", owner: Hashable = None) -> None:
+    """
+    Exempt an object from eviction, replacing the owner's previous pin of the group
+
+    A pin expires PIN_SECONDS after it was last renewed.
+
+    :param key: Object key
+    :param group: Pin group, one pinned key per owner and group
+    :param owner: Pin owner, e.g. a dashboard session, None for the whole process
+    """
+
+    with _manifest_lock:
+        _pinned[(owner, group)] = (key, time.time())
+
+
+def _pinned_keys() -> set[str]:
+    # Keys of the live pins, dropping the expired ones, called with _manifest_lock held
+    now = time.time()
+    for pin_id, (_, pinned_at) in list(_pinned.items()):
+        if now - pinned_at > PIN_SECONDS:
+            del _pinned[pin_id]
+
+    return {key for key, _ in _pinned.values()}
+
+
+# Function to evict the least recently used objects from the local data cache
+def evict_data(
+    budget: int = DATA_CACHE_BYTES,
+    data_dir: str = DATA_DIR,
+    manifest_path: str = MANIFEST_PATH,
+    keep: str | None = None,
+) -> list[str]:
+    """
+    Delete fetched objects, least recently used first, until they fit the budget
+
+    Only files recorded in the manifest are considered, pinned objects are kept.
+
+    :param budget: Byte budget
+    :param data_dir: Local directory mirroring the bucket
+    :param manifest_path: Manifest JSON file
+    :param keep: Key to keep as well, e.g. the object that was just fetched
+    :return: Keys of the evicted objects
+    """
+
+    evicted = []
+    with _manifest_lock:
+        manifest = read_manifest(manifest_path)
+        kept = _pinned_keys() | {keep}
+        total = sum(entry["size"] for entry in manifest.values())
+        for key, entry in sorted(manifest.items(), key=lambda item: item[1].get("accessed", 0)):
+            if total <= budget:
+                break
+            if key in kept:
+                continue
+            local_path = os.path.join(data_dir, key)
+            if os.path.isfile(local_path):
+                os.remove(local_path)
+            del manifest[key]
+            total -= entry["size"]
+            evicted.append(key)
+        if evicted:
+            _write_manifest(manifest, manifest_path)
+
+    return evicted
+
+
+# Function to fetch one object through the local data cache
+@span("s3.fetch")
+def fetch_object(
+    key: str,
+    data_dir: str = DATA_DIR,
+    bucket: str = BUCKET_NAME,
+    manifest_path: str = MANIFEST_PATH,
+    budget: int = DATA_CACHE_BYTES,
+    client: Any = None,
+) -> str:
+    """
+    Get the local path of an object, downloading it if it is not cached
+
+    Every fetch records an access time, downloads evict the least recently used
+    objects beyond the budget, never the fetched one. A cached copy is not revalidated against the bucket,
+    sync_data does that.
+
+    :param key: Object key
+    :param data_dir: Local directory mirroring the bucket
+    :param bucket: Bucket to fetch from
+    :param manifest_path: Manifest JSON file
+    :param budget: Byte budget of the cache
+    :param client: S3 client, defaults to the shared pooled client
+    :return: Local file path
+    """
+
+    local_path = os.path.join(data_dir, key)
+    with _manifest_lock:
+        entry = read_manifest(manifest_path).get(key)
+
+    downloaded = False
+    if not _local_matches(entry, local_path):
+        client = client or _s3().meta.client
+        try:
+            head = client.head_object(Bucket=bucket, Key=key)
+            mtime_ns = _download(client, bucket, key, local_path)
+        except Exception:
+            # Offline or unknown to the bucket, fall back to a local copy if there is one
+            if os.path.isfile(local_path):
+                return local_path
+            raise
+        entry = {"etag": head["ETag"], "size": head["ContentLength"], "mtime_ns": mtime_ns}
+        downloaded = True
+
+    with _manifest_lock:
+        manifest = read_manifest(manifest_path)
+        now = time.time()
+        if downloaded or now - manifest.get(key, {}).get("accessed", 0) >= ACCESS_RESOLUTION:
+            manifest[key] = {**entry, "accessed": now}
+            _write_manifest(manifest, manifest_path)
+
+    if downloaded:
+        evict_data(budget, data_dir, manifest_path, keep=key)
+
+    return local_path
+
+
+# Function to list the files of a data type
+def list_data(data_type: str, data_dir: str = DATA_DIR, bucket: str = BUCKET_NAME) -> list[str]:
+    """
+    List the files of a data type in the bucket, or locally when it is unreachable
+
+    :param data_type: Data type, one of DATA_TYPE
+    :param data_dir: Local directory mirroring the bucket
+    :param bucket: Bucket to list
+    :return: Sorted keys relative to the data type prefix, e.g. "site/image.jpg",
+        fetched with fetch_object(f"{data_type}/{name}")
+    """
+
+    prefix = f"{data_type}/"
+    try:
+        names = [key[len(prefix) :] for key in list_objects(prefix, bucket)]
+    except Exception:
+        local_dir = os.path.join(data_dir, data_type)
+        names = [
+            os.path.relpath(os.path.join(root, file), local_dir).replace(os.sep, "/")
+            for root, _, files in os.walk(local_dir)
+            for file in files
+        ]
+
+    # Folder placeholders end with "/", partial downloads with ".part"
+    return sorted(name for name in names if name and not name.endswith(("/", ".part")))
+
+
 # Function to download data from S3
-def download_data(data: str) -> bool | None:
-    """
-    Download a file from an S3 bucket
-
-    :param data: Data to download
-    :return: True if file was downloaded, else False
-    """
-
-    # Download the file
-    if data in DATA_TYPE:
-        for obj in _s3_bucket.objects.filter(Prefix=data):
-            # Check if folder exists
-            if not os.path.exists(os.path.dirname(f"data/{obj.key}")):
-                os.makedirs(os.path.dirname(f"data/{obj.key}"))
-            else:
-                # Check if file exists
-                if not os.path.isfile(f"data/{obj.key}"):
-                    # Download file from S3
-                    try:
-                        _s3_bucket.download_file(obj.key, f"data/{obj.key}")
-                        return True
-                    except Exception:
-                        # print(e)
-                        return False
-    else:
+def download_data(data: str) -> bool:
+    """
+    Bring a data folder up to date with the S3 bucket
+
+    :param data: Data to download, one of DATA_TYPE
+    :return: True if the folder is up to date, else False
+    """
+
+    if data not in DATA_TYPE:
+        return False
+
+    try:
+        return not sync_data(f"{data}/").failed
+    except Exception:
         return False
 
 
+# Function to list object keys under an S3 prefix
+def list_objects(prefix: str, bucket: str = BUCKET_NAME) -> list[str]:
+    """
+    List the object keys under an S3 prefix
+
+    :param prefix: Key prefix
+    :param bucket: Bucket to list
+    :return: Object keys, folder placeholders excluded
+    """
+
+    return [
+        obj.key
+        for obj in _s3().Bucket(bucket).objects.filter(Prefix=prefix)
+        if not obj.key.endswith("/")
+    ]
+
+
+# Function to read an S3 object into memory
+def read_object(key: str, bucket: str = BUCKET_NAME) -> bytes:
+    """
+    Read an S3 object into memory
+
+    :param key: Object key
+    :param bucket: Bucket to read from
+    :return: Object content
+    """
+
+    return _s3().Object(bucket, key).get()["Body"].read()
+
+
+# Function to compute the ETag S3 assigns to an upload
+def s3_etag(data: bytes | memoryview, options: dict[str, int] = UPLOAD_OPTIONS) -> str:
+    """
+    Compute the ETag of content uploaded with transfer options
+
+    Single part uploads get the MD5 of the content, multipart uploads the MD5 of
+    the parts' MD5s followed by the part count.
+
+    :param data: Content
+    :param options: Transfer options used for the upload
+    :return: Quoted ETag, as returned by S3 listings
+    """
+
+    view = memoryview(data)
+    if view.nbytes < options["multipart_threshold"]:
+        return f'"{hashlib.md5(view).hexdigest()}"'
+
+    size = options["multipart_chunksize"]
+    parts = [hashlib.md5(view[i : i + size]).digest() for i in range(0, view.nbytes, size)]
+    return f'"{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}"'
+
+
+class UploadResult(NamedTuple):
+    """
+    Outcome of one in-memory upload
+    """
+
+    name: str
+    key: str
+    status: Literal["uploaded", "duplicate", "failed"]
+
+
+# Function to upload in-memory files to S3 in parallel
+@span("s3.upload")
+def upload_buffers(
+    files: list[tuple[str, bytes | memoryview]],
+    data_type: str,
+    bucket: str = BUCKET_NAME,
+    workers: int = UPLOAD_WORKERS,
+    progress: Callable[[int, int], None] | None = None,
+    client: Any = None,
+) -> list[UploadResult]:
+    """
+    Stream in-memory files to S3 as parallel multipart uploads, skipping known content
+
+    Content already under the data type prefix, under any name, is detected by
+    comparing ETags from a single listing, so nothing is written to disk. New
+    content whose name is taken, in the bucket or earlier in the batch, is stored
+    under the name suffixed with its ETag instead of overwriting the other object.
+
+    :param files: (file name, content) pairs
+    :param data_type: Data type, one of DATA_TYPE
+    :param bucket: Bucket to upload to
+    :param workers: Number of files uploaded in parallel
+    :param progress: Called in the calling thread with (bytes sent, bytes to send)
+    :param client: S3 client, defaults to the shared pooled client
+    :return: One result per file, in input order
+    """
+
+    client = client or _s3().meta.client
+    prefix = f"{data_type}/"
+
+    known: dict[str, str] = {}
+    taken: set[str] = set()
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            known.setdefault(obj["ETag"], obj["Key"])
+            taken.add(obj["Key"])
+
+    results: list[UploadResult | None] = [None] * len(files)
+    todo: list[tuple[int, str, memoryview]] = []
+    for i, (name, data) in enumerate(files):
+        etag = s3_etag(data)
+        if etag in known:
+            results[i] = UploadResult(name, known[etag], "duplicate")
+            continue
+
+        key = f"{prefix}{os.path.basename(name)}"
+        if key in taken:
+            # Same name, different content: the ETag suffix keeps both objects
+            stem, ext = os.path.splitext(key)
+            digest = etag.strip('"').split("-")[0][:12]
+            key = f"{stem}-{digest}{ext}"
+        known[etag] = key
+        taken.add(key)
+        todo.append((i, key, memoryview(data)))
+
+    total = sum(view.nbytes for _, _, view in todo)
+    sent = [0]
+    lock = threading.Lock()
+
+    def _sent(nbytes: int) -> None:
+        with lock:
+            sent[0] += nbytes
+
+    def _upload(key: str, view: memoryview) -> None:
+        client.upload_fileobj(
+            io.BytesIO(view), bucket, key, Config=_transfer_config(upload=True), Callback=_sent
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_upload, key, view): (i, key) for i, key, view in todo}
+        futures = dict(pending)
+        while pending:
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+            if progress is not None:
+                with lock:
+                    progress(sent[0], total)
+
+    for future, (i, key) in futures.items():
+        status: Literal["uploaded", "failed"] = "failed" if future.exception() else "uploaded"
+        results[i] = UploadResult(files[i][0], key, status)
+
+    return [result for result in results if result is not None]
+
+
 # Function to save uploaded file
-def save_upload(file_obj: UploadedFile, data_type: str) -> str | Literal[False] | None:
+def save_upload(file_obj: "UploadedFile", data_type: str) -> str | Literal[False] | None:
     """
     Save uploaded file
 
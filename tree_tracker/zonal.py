@@ -0,0 +1,142 @@
+from collections.abc import Iterable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import rasterio  # type: ignore
+from rasterio.features import rasterize  # type: ignore
+from rasterio.windows import Window, from_bounds  # type: ignore
+
+from tree_tracker.indices import INDICES, read_indices
+from tree_tracker.tracing import span
+
+# Index value treated as nodata, as in the original get_parcel_stats
+NODATA_VALUE = 1.0
+
+
+# Function to rasterise parcels onto a raster grid
+def parcel_labels(geometries: Iterable[Any], shape: tuple[int, int], transform: Any) -> np.ndarray:
+    """
+    Burn parcel geometries into a label image, parcel i gets label i + 1
+
+    Where parcels overlap, the pixel belongs to the later parcel.
+
+    :param geometries: Parcel geometries in the raster CRS
+    :param shape: Grid shape (rows, cols)
+    :param transform: Grid affine transform
+    :return: int32 label image, 0 outside every parcel
+    """
+
+    shapes = [(geom, i + 1) for i, geom in enumerate(geometries) if geom is not None]
+    if not shapes:
+        return np.zeros(shape, dtype=np.int32)
+
+    return rasterize(shapes, out_shape=shape, transform=transform, fill=0, dtype="int32")
+
+
+# Function to compute per-label statistics in one vectorised pass
+def label_stats(values: np.ndarray, labels: np.ndarray, count: int) -> dict[str, np.ndarray]:
+    """
+    Compute min/max/mean of values for every label at once
+
+    :param values: Index array
+    :param labels: Label image of the same shape, 0 is ignored
+    :param count: Number of labels
+    :return: Arrays of length count for min, max, mean and pixels, NaN for empty labels
+    """
+
+    valid = (labels > 0) & ~np.isnan(values) & (values != NODATA_VALUE)
+    lab = labels[valid]
+    val = values[valid].astype(np.float64)
+
+    pixels = np.bincount(lab, minlength=count + 1)[1:]
+    total = np.bincount(lab, weights=val, minlength=count + 1)[1:]
+
+    mins = np.full(count, np.nan)
+    maxs = np.full(count, np.nan)
+    if lab.size:
+        # Group the pixels by label, then reduce each contiguous run
+        order = np.argsort(lab, kind="stable")
+        lab, val = lab[order], val[order]
+        starts = np.flatnonzero(np.r_[True, lab[1:] != lab[:-1]])
+        mins[lab[starts] - 1] = np.minimum.reduceat(val, starts)
+        maxs[lab[starts] - 1] = np.maximum.reduceat(val, starts)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(pixels > 0, total / pixels, np.nan)
+
+    return {"min": mins, "max": maxs, "mean": means, "pixels": pixels}
+
+
+# Function to get the raster window covering some bounds
+def parcel_window(src: Any, bounds: tuple[float, float, float, float]) -> Window | None:
+    """
+    Get the smallest raster window covering bounds, clipped to the raster
+
+    :param src: Open rasterio dataset
+    :param bounds: (min_x, min_y, max_x, max_y) in the raster CRS
+    :return: Window, or None if the bounds do not overlap the raster
+    """
+
+    window = from_bounds(*bounds, transform=src.transform).round_offsets().round_lengths()
+    try:
+        return window.intersection(Window(0, 0, src.width, src.height))
+    except rasterio.errors.WindowError:
+        return None
+
+
+# Function to compute per-parcel index time series over several scenes
+@span("zonal.parcel_time_series")
+def parcel_time_series(
+    paths: Iterable[str], parcels: Any, indices: Iterable[str] = INDICES
+) -> pd.DataFrame:
+    """
+    Compute per-parcel index statistics for every scene
+
+    Parcels are rasterised once per scene grid and all parcels are summarised
+    in a single pass, only the window covering the parcels is read.
+
+    :param paths: Scene GeoTIFFs
+    :param parcels: GeoDataFrame of parcels, its index identifies the parcels
+    :param indices: Index names to compute
+    :return: One row per (scene, parcel) with pixels inside the parcel
+    """
+
+    indices = list(indices)
+    columns = ["path", "parcel", "pixels"] + [
+        f"{name}_{stat}" for name in indices for stat in ("min", "max", "average")
+    ]
+    grids: dict[tuple, tuple[Window | None, np.ndarray | None]] = {}
+    frames = []
+
+    for path in paths:
+        with rasterio.open(path) as src:
+            grid = (src.crs.to_string(), tuple(src.transform), src.width, src.height)
+            if grid not in grids:
+                geoms = parcels.geometry.to_crs(src.crs)
+                window = parcel_window(src, tuple(geoms.total_bounds))
+                labels = None
+                if window is not None:
+                    shape = (int(window.height), int(window.width))
+                    labels = parcel_labels(geoms, shape, src.window_transform(window))
+                grids[grid] = (window, labels)
+
+            window, labels = grids[grid]
+            if window is None or labels is None or not labels.any():
+                continue
+
+            arrays, _ = read_indices(src, indices, window=window)
+
+        frame = pd.DataFrame({"path": path, "parcel": parcels.index})
+        frame["pixels"] = np.bincount(labels.ravel(), minlength=len(parcels) + 1)[1:]
+        for name in indices:
+            stats = label_stats(arrays[name], labels, len(parcels))
+            frame[f"{name}_min"] = stats["min"]
+            frame[f"{name}_max"] = stats["max"]
+            frame[f"{name}_average"] = stats["mean"]
+        frames.append(frame[frame["pixels"] > 0])
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(frames, ignore_index=True)[columns]